@@ -0,0 +1,111 @@
+"""
+Benchmark of recommenders for regret and throughput, e.g. the sketched LinUCB against the exact one.
+
+Every model is trained and tested on the same random training/testing splits, and the report lists
+per model the number of features, the size of the model state, the training throughput and the mean
+training regret / testing error rate over the iterations.
+"""
+import time
+import argparse
+import logging
+import numpy as np
+import evaluation
+from warfarin import *
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--algos", required=False, type=str, default="linucb_disjoint,linucb_sketch",
+                    help="comma separated list of algos, see --algo of warfarin.py")
+parser.add_argument("--sketch_sizes", required=False, type=str, default="10,20,40",
+                    help="comma separated list of sketch sizes of linucb_sketch")
+parser.add_argument("--feature_set", required=False, type=str,
+                    help="feature set of all models, default is the feature set of each model")
+parser.add_argument("--sparse", action="store_true", help="pass sparse features to the models")
+parser.add_argument("--data", required=False, type=str, default="data/warfarin.csv",
+                    help="path to the patient data csv, or a directory / glob pattern of csv shards")
+parser.add_argument("--iter", required=False, type=int, default=3)
+parser.add_argument("--train_ratio", required=False, type=float, default=0.8)
+parser.add_argument("--seed", required=False, type=int, default=0)
+
+
+def get_models(algos, sketch_sizes, feature_set=None, sparse=False, output_path="results/"):
+    """
+    :param algos: list of algos
+    :param sketch_sizes: list of sketch sizes, one linucb_sketch model per sketch size
+    :param feature_set: feature set of all models, None for the feature set of each model
+    :param sparse: whether to pass sparse features to the models
+    :param output_path: output path of the model configs
+    :return: list of (name, model)
+    """
+    models = []
+    for algo in algos:
+        for sketch_size in (sketch_sizes if algo == "linucb_sketch" else [None]):
+            config = get_config(algo, output_path)
+            if feature_set is not None:
+                config.feature_set = feature_set
+            if sketch_size is not None:
+                config.sketch_size = sketch_size
+            config.sparse_features = sparse
+            model = get_recommender(algo, output_path, config)
+            name = config.algo_name if sketch_size is None else f"{config.algo_name}(m={sketch_size})"
+            models.append((name, model))
+    return models
+
+
+def get_state_size(model):
+    """
+    :return: number of bytes of the numpy arrays held by the model
+    """
+    return sum(v.nbytes for v in vars(model).values() if isinstance(v, np.ndarray))
+
+
+def benchmark(patients, models, num_iter=3, trainset_ratio=0.8):
+    """
+    Train and test the models on the same random splits
+
+    :param patients: PatientDataset
+    :param models: list of (name, model), see get_models
+    :param num_iter: number of iterations
+    :param trainset_ratio: ratio of the data set used for training
+    :return: list of dicts of the benchmark results of every model
+    """
+    splits = [evaluation.shuffle_split_data_set(patients, trainset_ratio) for i in range(num_iter)]
+    feature_cache = FeatureCache(patients)
+    reports = []
+    for name, model in models:
+        features = feature_cache.get(model.feature_set, model.config.sparse_features)
+        seconds, regrets, err_rates = [], [], []
+        for training_indices, testing_indices in splits:
+            model.reset()
+            start = time.perf_counter()
+            _, training_regrets, _, _, _, _ = model.run(patients, training_indices, None, 0, is_training=True,
+                                                        features=features)
+            seconds.append(time.perf_counter() - start)
+            regrets.append(np.sum(training_regrets))
+            if len(testing_indices) > 0:
+                _, _, testing_mistakes, _, _, _ = model.run(patients, testing_indices, None, 0, features=features)
+                err_rates.append(np.mean(testing_mistakes))
+        reports.append({"model": name, "d": model.feature_set.dim, "state_kb": get_state_size(model) / 1024,
+                        "patients_per_s": len(splits[0][0]) / np.mean(seconds),
+                        "training_regret": np.mean(regrets),
+                        "testing_err_rate": np.mean(err_rates) if err_rates else float("nan")})
+        logging.info(f"Benchmarked: {reports[-1]}")
+    return reports
+
+
+def format_reports(reports):
+    lines = [f"{'model':<24}{'d':>6}{'state KB':>12}{'patients/s':>12}{'train regret':>14}{'test err':>10}"]
+    for r in reports:
+        lines.append(f"{r['model']:<24}{r['d']:>6}{r['state_kb']:>12.1f}{r['patients_per_s']:>12.0f}"
+                     f"{r['training_regret']:>14.1f}{r['testing_err_rate']:>10.4f}")
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s:%(levelname)s: %(message)s', level=logging.INFO)
+    np.random.seed(args.seed)
+
+    models = get_models(args.algos.split(","), [int(m) for m in args.sketch_sizes.split(",")],
+                        args.feature_set, args.sparse)
+    patients = load_data(args.data, selected=get_required_columns([model for _, model in models]))
+    print(format_reports(benchmark(patients, models, args.iter, args.train_ratio)))
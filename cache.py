@@ -0,0 +1,117 @@
+"""
+Binary cache of the parsed patient data set.
+
+The column-oriented data set produced by ingest.parse_columns is stored in a single .npz file.
+
+The cache file name is keyed by the content hash of the csv, the keep_missing flag, the parsed
+columns (column projection) and CACHE_VERSION, which must be bumped whenever the parsing in
+preprocess.py changes. A projected data set is also served from the cache of all columns.
+"""
+import os
+import hashlib
+import logging
+import numpy as np
+from ingest import *
+
+CACHE_VERSION = 3
+CACHE_DIR = "data/.cache/"
+
+
+def get_file_hash(filename, chunk_size=1 << 20):
+    """
+    Compute the content hash of the given file
+
+    :param filename: path to the file
+    :param chunk_size: number of bytes to read at once
+    :return: hex digest of the file content
+    """
+    digest = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_cache_filename(filename, keep_missing, selected=None, cache_dir=CACHE_DIR):
+    """
+    Return the cache file name for the given csv file and parsing options
+
+    :param filename: path to the csv
+    :param keep_missing: whether records with missing essential data are kept
+    :param selected: parsed columns (see ingest.get_parsed_columns), all columns if None
+    :param cache_dir: directory with the cache files
+    :return: path to the cache file
+    """
+    parsed = "all" if selected is None else ",".join(get_parsed_columns(selected))
+    digest = hashlib.sha1(f"{get_file_hash(filename)};keep_missing={keep_missing};columns={parsed};"
+                          f"version={CACHE_VERSION}".encode("utf-8")).hexdigest()
+    name = os.path.splitext(os.path.basename(filename))[0]
+    return os.path.join(cache_dir, f"{name}-{digest[:16]}.npz")
+
+
+def save_cache(cache_filename, columns, raw_count):
+    """
+    Save the parsed patient data set into a cache file
+
+    :param cache_filename: path to the cache file
+    :param columns: dict of column name -> numpy array
+    :param raw_count: number of records in the csv (before filtering out missing data)
+    """
+    os.makedirs(os.path.dirname(cache_filename) or ".", exist_ok=True)
+    # npz entries are keyed by position, column names may contain '/'
+    names = list(columns.keys())
+    arrays = {f"c{i}": columns[name] for i, name in enumerate(names)}
+    # write to a temporary file first so that concurrent runs never see a partial cache
+    tmp_filename = f"{cache_filename}.{os.getpid()}.tmp"
+    with open(tmp_filename, "wb") as f:
+        np.savez(f, names=np.array(names), raw_count=np.array(raw_count), **arrays)
+    os.replace(tmp_filename, cache_filename)
+    logging.info(f"Saved parsed data set cache: {cache_filename}")
+
+
+def load_cache(cache_filename, selected=None):
+    """
+    Load the parsed patient data set from a cache file
+
+    :param cache_filename: path to the cache file
+    :param selected: columns to load (see ingest.get_parsed_columns), all columns if None
+    :return: (dict of column name -> numpy array, number of records in the csv)
+        or (None, None) if the cache does not exist
+    """
+    if not os.path.exists(cache_filename):
+        return None, None
+    parsed = None if selected is None else set(get_parsed_columns(selected))
+    with np.load(cache_filename) as data:
+        # npz entries are read on access, entries of other columns are skipped
+        columns = {name: data[f"c{i}"] for i, name in enumerate(data["names"].tolist())
+                   if parsed is None or get_column_name(name) in parsed}
+        raw_count = int(data["raw_count"])
+    logging.info(f"Loaded parsed data set cache: {cache_filename}")
+    return columns, raw_count
+
+
+def load_columns(filename, keep_missing=False, use_cache=True, selected=None):
+    """
+    Load the column-oriented data set (see ingest.parse_columns) from the csv. The parsed
+    data set is cached in CACHE_DIR, so that subsequent loads of the same csv skip parsing.
+
+    :param filename: path to the csv
+    :param keep_missing: whether to keep records with missing essential data
+    :param use_cache: whether to load / store the parsed data set from / to the cache
+    :param selected: columns to parse (see ingest.get_parsed_columns), all columns if None
+    :return: dict of column name -> numpy array, number of records in the csv
+    """
+    cache_filename = get_cache_filename(filename, keep_missing, selected) if use_cache else None
+    columns, raw_count = load_cache(cache_filename) if cache_filename is not None else (None, None)
+    if columns is None and use_cache and selected is not None:
+        columns, raw_count = load_cache(get_cache_filename(filename, keep_missing), selected)
+
+    if columns is None:
+        with open(filename, newline="") as f:
+            raw_columns = read_raw_columns(f, set(get_parsed_columns(selected)))
+        raw_count = len(raw_columns[DOSE])
+        columns = parse_columns(raw_columns, keep_missing=keep_missing, verbose=False, selected=selected)
+        if cache_filename is not None:
+            save_cache(cache_filename, columns, raw_count)
+
+    return columns, raw_count
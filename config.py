@@ -7,6 +7,11 @@ class ConfigCommon:
         # output config
         self.output_path = output_path
         self.ensemble_list = ["LinUCBDisjoint", "DTree-Alt", "Lasso"]
+        # name of the feature set in feature_set.FEATURE_SETS, None if the model uses no features
+        self.feature_set = None
+        # whether the model receives the features as scipy.sparse CSR rows (models with a sparse-aware
+        # code path: LinUCBDisjoint, SketchedLinUCB, LinTS, Lasso; LinUCBHybrid densifies the rows)
+        self.sparse_features = False
 
     def get_truth_filename(self, is_training):
         s = "training" if is_training else "testing"
@@ -51,6 +56,7 @@ class ConfigClinicalDose(ConfigCommon):
     def __init__(self, output_path):
         super().__init__(output_path)
         self.algo_name = "ClinicalDose"
+        self.feature_set = "clinical"
 
 
 class ConfigLinUCBDisjoint(ConfigCommon):
@@ -62,7 +68,11 @@ class ConfigLinUCBDisjoint(ConfigCommon):
         # parameters for the model
         self.actions = [DOSE_LOW, DOSE_MED, DOSE_HIGH]
         self.alpha = 0.01
-        self.feature_count = 134  # this must match actual feature count
+        # "full134_meds" adds a hashed bag of the listed medications
+        self.feature_set = "full134"
+        # A^-1 of every arm is updated incrementally (Sherman-Morrison), and recomputed from A
+        # after every refactor_interval updates of the arm to bound the numerical drift (0: never)
+        self.refactor_interval = 0
 
 
 class ConfigLinUCBDisjointBasic(ConfigLinUCBDisjoint):
@@ -72,7 +82,60 @@ class ConfigLinUCBDisjointBasic(ConfigLinUCBDisjoint):
         self.algo_name = "LinUCBDisjointBasic"
 
         # parameters for the model
-        self.feature_count = 9  # this must match actual feature count
+        self.feature_set = "clinical"
+
+class ConfigSketchedLinUCB(ConfigCommon):
+
+    def __init__(self, output_path):
+        super().__init__(output_path)
+        self.algo_name = "SketchedLinUCB"
+
+        # parameters for the model
+        self.actions = [DOSE_LOW, DOSE_MED, DOSE_HIGH]
+        self.alpha = 0.01
+        self.feature_set = "full134"
+        # rank of the Frequent Directions sketch of every arm, the sketch holds up to 2 * sketch_size rows
+        self.sketch_size = 20
+        # ridge regularization lambda of A = D^T * D + lambda * I (1 in LinUCBDisjoint)
+        self.ridge = 1.0
+
+
+class ConfigLinTS(ConfigCommon):
+
+    def __init__(self, output_path):
+        super().__init__(output_path)
+        self.algo_name = "LinTS"
+
+        # parameters for the model
+        self.actions = [DOSE_LOW, DOSE_MED, DOSE_HIGH]
+        # scale of the posterior covariance v^2 * A^-1
+        self.v = 0.01
+        self.feature_set = "full134"
+        # see ConfigLinUCBDisjoint
+        self.refactor_interval = 0
+        # the Cholesky factor of A^-1 used for sampling is recomputed after every factor_interval
+        # updates of the arm (None: d, the number of features, so that the amortized cost of the O(d^3)
+        # factorizations is O(d^2) per update as for LinUCB)
+        self.factor_interval = None
+
+
+class ConfigLinUCBHybrid(ConfigCommon):
+
+    def __init__(self, output_path):
+        super().__init__(output_path)
+        self.algo_name = "LinUCBHybrid"
+
+        # parameters for the model
+        self.actions = [DOSE_LOW, DOSE_MED, DOSE_HIGH]
+        self.alpha = 0.01
+        self.feature_set = "full134"
+        # names of the features of feature_set shared by all arms (scaled by the centered ordinal of
+        # the arm), all features if None
+        self.shared_features = None
+        # the inverses are updated incrementally (Sherman-Morrison), and recomputed after every
+        # refactor_interval updates of the arm to bound the numerical drift (0: never)
+        self.refactor_interval = 0
+
 
 class ConfigTreeHeuristic(ConfigCommon):
     def __init__(self, output_path):
@@ -90,13 +153,22 @@ class ConfigTreeHeuristic(ConfigCommon):
         self.max_leaf_nodes = 4
 
         self.criterion = "gini"
-        self.feature_set = "exdended"
+        self.feature_set = "extended"
+
+        # incremental Hoeffding / EFDT trees (see hoeffding_tree.py) updated in O(depth * d) per sample
+        # if True, sklearn trees refitted on the whole history of the arm after every sample otherwise
+        self.incremental = True
+        # delta of the Hoeffding bound of the split tests, number of samples of a node between split
+        # evaluations and maximum number of bins of the split statistics of a feature
+        self.split_confidence = 0.2
+        self.grace_period = 20
+        self.num_bins = 16
 
 class ConfigTreeHeuristicBasic(ConfigTreeHeuristic):
     def __init__(self, output_path):
         super().__init__(output_path)
         self.algo_name = "DTree"
-        self.feature_set = "clinical"
+        self.feature_set = "basic"
         self.tree_depth = 4
 
 
@@ -114,6 +186,21 @@ class ConfigLasso(ConfigCommon):
         self.h = 5
         self.lambda1 = 0.05
         self.lambda2 = 0.05
+        # tolerance (as in sklearn.linear_model.Lasso) and maximum number of sweeps of the coordinate
+        # descent of the refits, see lasso_bandit.GramLasso
+        self.tol = 1e-4
+        self.max_iter = 1000
+        # whether the refits start from the previous coefficients: fewer sweeps, but the refits may
+        # converge to another Lasso minimizer than a sklearn refit (see lasso_bandit.GramLasso)
+        self.warm_start = False
+        # retention of the past samples of every arm (forced samples and all samples): "all" keeps
+        # every sample, "window" the last retention_size samples and "reservoir" a uniform random
+        # sample of retention_size samples. With a bounded retention, the lambda2 schedule stops
+        # decaying once K * retention_size samples are retained, see lasso_bandit.LassoBandit
+        self.retention = "all"
+        self.retention_size = 1000
+        # "full134_meds" adds a hashed bag of the listed medications
+        self.feature_set = "full134"
 
 
 class ConfigEnsembleMajority3(ConfigCommon):
@@ -135,6 +222,12 @@ def get_config(algo_name, output_path):
         return ConfigLinUCBDisjoint(output_path)
     elif algo_name == "linucb_disjoint_basic":
         return ConfigLinUCBDisjointBasic(output_path)
+    elif algo_name == "linucb_sketch":
+        return ConfigSketchedLinUCB(output_path)
+    elif algo_name == "lints":
+        return ConfigLinTS(output_path)
+    elif algo_name == "linucb_hybrid":
+        return ConfigLinUCBHybrid(output_path)
     elif algo_name == "tree":
         return ConfigTreeHeuristic(output_path)
     elif algo_name == "tree_basic":
@@ -84,12 +84,20 @@ BINARY_FEATURES = [DIABETES, CHF, VALVE_REPLACE, ASPIRIN, TYLENOL, WAS_DOSE, ZOC
 LESCOL, MEVACOR, PRAVACHOL, CRESTOR, BAYCOL, CORDARONE, TEGRETOL, DILANTIN, RIFAMPIN, SULFONAMIDE,
 MACROLIDE, ANTI_FUNGAL, HERBAL, IS_STABLE, SMOKER]
 
+# derived flags: any of the binary medication features is true or any of the medications is listed
+ENZYME_INDUCER = "Enzyme inducer"
+ENZYME_INDUCER_FEATURES = [TEGRETOL, DILANTIN, RIFAMPIN]
+ENZYME_INDUCER_MEDICATIONS = ["carbamazepine", "phenytoin", "rifampin", "rifampicin"]
+AMIODARONE = "Amiodarone"
+AMIODARONE_FEATURES = [CORDARONE]
+AMIODARONE_MEDICATIONS = ["amiodarone"]
+
 # 7 VKORC1 genotype features
 VKORC1_GENO_FEATURES = [VKORC1_1639, VKORC1_497, VKORC1_1173, VKORC1_1542,
                  VKORC1_3730, VKORC1_2255, VKORC1_4451]
 
 
 # command line options for algorithms
-ALGOS = ["fixed_dose", "clinical_dose", "linucb_disjoint", "linucb_disjoint_basic",
-         "lasso", "tree_basic", "tree", "majority3"]
+ALGOS = ["fixed_dose", "clinical_dose", "linucb_disjoint", "linucb_disjoint_basic", "linucb_hybrid",
+         "linucb_sketch", "lints", "lasso", "tree_basic", "tree", "majority3"]
 
@@ -0,0 +1,106 @@
+"""
+Compact array-backed patient data set.
+
+Scalar properties of all patients are stored in one structured numpy record array (one row
+per patient): the dose label and the enum values as int8 codes, numerical properties as float64.
+List properties (indications, CYP2C9, medications) are stored as flat values plus offsets
+(CSR layout), medications as int32 ids into the vocabulary of distinct medication strings
+of the data set (interned at ingest). Patient objects are created on demand as views of a row, so the data set holds
+no per-patient Python objects. A data set parsed with a column projection holds only the
+projected properties.
+"""
+import numpy as np
+from feature import *
+from ingest import *
+from patient import *
+
+# record array layout of the scalar properties
+RECORD_DTYPE = np.dtype([(DOSE, np.int8)] +
+                        [(p, np.float64) for p in NUMERICAL_FEATURES] +
+                        [(p, np.int8) for p in PROPERTY_ENUMS] +
+                        [(p, np.bool_) for p in DERIVED_FLAGS])
+
+# properties holding a list of values
+LIST_PROPERTIES = list(LIST_PROPERTY_ENUMS) + [MEDICATIONS]
+
+# enum value -> enum member, for each enum (list) property
+ENUM_MEMBERS = {p: {e.value: e for e in enum_type}
+                for p, enum_type in list(PROPERTY_ENUMS.items()) + list(LIST_PROPERTY_ENUMS.items())}
+
+
+class PatientDataset:
+    """
+    Class to represent the patient data set. Behaves as a read-only sequence of Patient.
+    """
+    def __init__(self, columns):
+        """
+        :param columns: column-oriented data set (possibly projected), see ingest.parse_columns
+        """
+        dtype = np.dtype([(name, RECORD_DTYPE.fields[name][0]) for name in RECORD_DTYPE.names if name in columns])
+        self.records = np.empty(get_row_count(columns), dtype=dtype)
+        for name in dtype.names:
+            self.records[name] = columns[name]
+        self.lists = {name: (columns[name], columns[name + OFFSETS]) for name in LIST_PROPERTIES
+                      if name in columns}
+        self.medication_vocab = []
+        if MEDICATIONS in columns:
+            self.medication_vocab = [None if m == MEDICATION_NONE else m for m in columns[MEDICATIONS + VOCAB].tolist()]
+        self.property_names = list(dtype.names) + [name for name in LIST_PROPERTIES if name in self.lists]
+
+        # per column views of the record array for fast row access
+        self.columns = {name: self.records[name] for name in dtype.names}
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, index):
+        return Patient(self, int(index))
+
+    def __iter__(self):
+        return (Patient(self, i) for i in range(len(self)))
+
+    @property
+    def labels(self):
+        """
+        :return: dose labels of all patients
+        """
+        return self.columns[DOSE]
+
+    def get_value(self, name, index):
+        """
+        Decode a property of a patient
+
+        :param name: property (column) name
+        :param index: row of the patient
+        :return: value as in the per-patient dict of properties: enum, list of enums, float or int
+        """
+        members = ENUM_MEMBERS.get(name)
+        column = self.columns.get(name)
+        if column is not None:
+            value = column.item(index)
+            return value if members is None else members[value]
+
+        values, offsets = self.lists[name]
+        items = values[offsets[index]:offsets[index + 1]].tolist()
+        if members is not None:
+            return [members[v] for v in items]
+        return [self.medication_vocab[m] for m in items]
+
+    def to_columns(self):
+        """
+        :return: column-oriented data set, see ingest.parse_columns
+        """
+        columns = {name: self.records[name] for name in self.records.dtype.names}
+        for name, (values, offsets) in self.lists.items():
+            columns[name], columns[name + OFFSETS] = values, offsets
+        if MEDICATIONS in self.lists:
+            columns[MEDICATIONS + VOCAB] = np.array([MEDICATION_NONE if m is None else m for m in self.medication_vocab],
+                                                    dtype=np.str_)
+        return columns
+
+    def take(self, rows):
+        """
+        :param rows: indices of the patients to select
+        :return: PatientDataset with the selected patients
+        """
+        return PatientDataset(take_rows(self.to_columns(), rows))
@@ -0,0 +1,123 @@
+"""
+Precompiled one-hot encoding tables.
+
+Every enum type is compiled once into an EnumEncoder holding the enum value -> one-hot
+column offset table. OneHotBlock concatenates the one-hot encodings of several dataset
+columns and encodes a whole batch of patients with numpy fancy indexing.
+"""
+import numpy as np
+from feature import *
+from util import *
+
+
+class EnumEncoder:
+    """
+    One-hot encoding table of an enum type
+    """
+    def __init__(self, enum_type):
+        self.enum_type = enum_type
+        self.members = list(enum_type)
+        self.width = len(self.members)
+        # enum value - min_value -> one-hot column (-1 for values which are not members)
+        values = [e.value for e in self.members]
+        self.min_value = min(values)
+        self.table = np.full(max(values) - self.min_value + 1, -1, dtype=np.int64)
+        for i, v in enumerate(values):
+            self.table[v - self.min_value] = i
+
+    def get_columns(self, codes):
+        """
+        :param codes: numpy array of enum values
+        :return: one-hot columns of the given enum values (-1 for values which are not members)
+        """
+        return self.table[codes.astype(np.int64) - self.min_value]
+
+
+_encoders = dict()
+
+
+def get_encoder(enum_type):
+    """
+    Return the (cached) EnumEncoder of the given enum type
+    """
+    encoder = _encoders.get(enum_type)
+    if encoder is None:
+        encoder = _encoders[enum_type] = EnumEncoder(enum_type)
+    return encoder
+
+
+class OneHotBlock:
+    """
+    Concatenation of the one-hot encodings of several dataset columns
+    """
+    def __init__(self, names):
+        """
+        :param names: column names; columns of LIST_PROPERTY_ENUMS are multi-hot encoded
+        """
+        self.names = list(names)
+        self.columns = self.names
+        self.encoders = [get_encoder(PROPERTY_ENUMS.get(n) or LIST_PROPERTY_ENUMS[n]) for n in self.names]
+        self.offsets = np.cumsum([0] + [e.width for e in self.encoders])
+        self.width = int(self.offsets[-1])
+
+    def get_feature_names(self):
+        return [f"{n}={e.name}" for n, encoder in zip(self.names, self.encoders) for e in encoder.members]
+
+    def get_coordinates(self, dataset, rows):
+        """
+        Coordinates of the ones of the one-hot encoding of the given patients
+
+        :param dataset: PatientDataset
+        :param rows: indices of the patients
+        :return: positions of the patients in rows, one-hot columns (numpy arrays of the same length)
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        patients, columns = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+
+        scalar = [i for i, n in enumerate(self.names) if n not in LIST_PROPERTY_ENUMS]
+        if len(scalar) > 0 and len(rows) > 0:
+            # (n, number of scalar columns) one-hot column offsets
+            scalar_columns = np.stack([self.encoders[i].get_columns(dataset.columns[self.names[i]][rows])
+                                       for i in scalar], axis=1)
+            valid = scalar_columns >= 0
+            scalar_columns += self.offsets[scalar]
+            patients.append(np.nonzero(valid)[0])
+            columns.append(scalar_columns[valid])
+
+        for i, name in enumerate(self.names):
+            if name in LIST_PROPERTY_ENUMS:
+                values, offsets = take_csr(*dataset.lists[name], rows)
+                list_patients = np.repeat(np.arange(len(rows)), offsets[1:] - offsets[:-1])
+                list_columns = self.encoders[i].get_columns(values)
+                valid = list_columns >= 0
+                patients.append(list_patients[valid])
+                columns.append(list_columns[valid] + self.offsets[i])
+        return np.concatenate(patients), np.concatenate(columns)
+
+    def encode(self, dataset, rows, out=None):
+        """
+        One-hot encode the given patients
+
+        :param dataset: PatientDataset
+        :param rows: indices of the patients
+        :param out: optional (len(rows), width) array to write into (must be zero)
+        :return: (len(rows), width) float matrix
+        """
+        if out is None:
+            out = np.zeros((len(rows), self.width))
+        out[self.get_coordinates(dataset, rows)] = 1
+        return out
+
+    def encode_coordinates(self, dataset, rows):
+        """
+        :return: positions of the patients in rows, columns and values of the non-zero features
+        """
+        patients, columns = self.get_coordinates(dataset, rows)
+        # list properties may hold a value more than once (e.g. CYP2C9 *1/*1)
+        keys = np.unique(patients * self.width + columns)
+        return keys // self.width, keys % self.width, np.ones(len(keys))
+
+
+# one-hot part of the features of LinUCBDisjointRecommender and LassoBandit,
+# size: 9 + 3 + 5 + 23 * 3 + 15 + 7 * 4 = 129
+BANDIT_ONE_HOT_BLOCK = OneHotBlock([INDICATION, GENDER, RACE] + BINARY_FEATURES + [CYP2C9] + VKORC1_GENO_FEATURES)
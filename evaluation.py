@@ -4,6 +4,8 @@ import logging
 import math
 from config import *
 from util import *
+from feature_set import *
+from recommender import train_parallel
 import time
 
 class EvalResults:
@@ -27,7 +29,7 @@ class EvalResults:
 
     def log_truths(self, iter_idx, patients, indices):
         if len(self.truths[iter_idx]) == 0:
-            self.truths[iter_idx] = [patients[i].properties[DOSE] for i in indices]
+            self.truths[iter_idx] = patients.labels[indices].tolist()
 
     def log_results(self, model_idx, iter_idx, actions, regrets, mistakes, payoffs, conf_intervals, risks):
         self.actions[model_idx][iter_idx] = actions
@@ -150,7 +152,43 @@ def shuffle_split_data_set(patients, trainset_ratio=0.8):
     return training_indices, testing_indices
 
 
-def run(patients, models, num_iter=1, trainset_ratio=0.8, verbose=False):
+def run_replicas(patients, m, model, splits, training_results, testing_results, features, verbose=False):
+    """
+    Run all iterations of a model with a replica engine (see LinUCBDisjointRecommender.run_replicas)
+    at once, one replica per iteration, and log the results of every iteration
+
+    :param patients: complete patient data set
+    :param m: index of the model
+    :param model: Recommender with reset_replicas / run_replicas
+    :param splits: list of (training indices, testing indices) of every iteration
+    :param training_results: EvalResults of the training sets, None if there is no training set
+    :param testing_results: EvalResults of the testing sets, None if there is no testing set
+    :param features: precomputed feature matrix of the model's feature set, see FeatureCache
+    :param verbose: whether to print progress
+    """
+    model.reset_replicas(len(splits))
+    for results, indices, is_training in ((training_results, [s[0] for s in splits], True),
+                                          (testing_results, [s[1] for s in splits], False)):
+        if results is None:
+            continue
+        msg = f"{'Training' if is_training else 'Testing'} Iterations: 0-{len(splits) - 1} (replicas), " \
+            f"model: {model.config.algo_name}"
+        logging.info(msg)
+        if verbose:
+            print(msg)
+
+        replica_results = model.run_replicas(patients, np.array(indices), is_training=is_training, features=features)
+        for i in range(len(splits)):
+            results.log_truths(i, patients, indices[i])
+            results.log_results(m, i, *replica_results[i])
+            msg = f"Iteration: {i}, total regret: {results.get_per_iter_total_regret_for_model(m, i)}, " \
+                f"err rate: {results.get_per_iter_err_rate_for_model(m, i)}"
+            logging.info(msg)
+            if verbose:
+                print(msg)
+
+
+def run(patients, models, num_iter=1, trainset_ratio=0.8, verbose=False, replicas=False, train_workers=None):
 
     logging.info(f"Starting model training/evaluation with: {len(patients)} patients, {num_iter} iterations,"
                  f"train_ratio={trainset_ratio}")
@@ -168,16 +206,30 @@ def run(patients, models, num_iter=1, trainset_ratio=0.8, verbose=False):
     training_results = EvalResults(True, models, num_iter) if trainset_ratio > 0 else None
     testing_results = EvalResults(False, models, num_iter) if trainset_ratio < 1 else None
 
+    # feature matrices are computed once per feature set and shared by all models and iterations
+    feature_cache = FeatureCache(patients)
+
+    # models with a replica engine run all iterations at once, in lockstep, on the splits drawn upfront
+    replicated = [m for m in range(len(models)) if replicas and hasattr(models[m], "run_replicas")]
+    splits = [shuffle_split_data_set(patients, trainset_ratio) for i in range(num_iter)] if replicas else None
+    for m in replicated:
+        run_replicas(patients, m, models[m], splits, training_results, testing_results,
+                     feature_cache.get(models[m].feature_set, models[m].config.sparse_features), verbose)
+
     # perform N-fold validation based on the provided training/testing split
     # train the model on the training set then freeze the model to test on the testing set
     for i in range(num_iter):
 
-        training_indices, testing_indices = shuffle_split_data_set(patients, trainset_ratio)
+        training_indices, testing_indices = splits[i] if replicas else shuffle_split_data_set(patients,
+                                                                                                trainset_ratio)
 
         for m in range(len(models)):
+            if m in replicated:
+                continue
 
             model = models[m]
             model.reset()
+            features = feature_cache.get(model.feature_set, model.config.sparse_features)
 
             # training on the training set
             if trainset_ratio > 0:
@@ -189,9 +241,16 @@ def run(patients, models, num_iter=1, trainset_ratio=0.8, verbose=False):
                 # log ground truth for error analysis
                 training_results.log_truths(i, patients, training_indices)
 
-                training_actions, training_regrets, training_mistakes, training_payoffs, \
-                training_conf_intervals, training_risks = \
-                    model.run(patients, training_indices, training_results, i, is_training=True)
+                if train_workers is not None and train_workers > 1 and model.supports_merge:
+                    # shards of the training set trained in a process pool, see recommender.train_parallel
+                    training_actions, training_regrets, training_mistakes, training_payoffs, \
+                    training_conf_intervals, training_risks = \
+                        train_parallel(model, patients, training_indices, train_workers, features)
+                else:
+                    training_actions, training_regrets, training_mistakes, training_payoffs, \
+                    training_conf_intervals, training_risks = \
+                        model.run(patients, training_indices, training_results, i, is_training=True,
+                                  features=features)
                 # log training regret, estimated payoff & its confidence interval
                 training_results.log_results(m, i, training_actions, training_regrets, training_mistakes,
                                              training_payoffs, training_conf_intervals, training_risks)
@@ -214,7 +273,7 @@ def run(patients, models, num_iter=1, trainset_ratio=0.8, verbose=False):
 
                 testing_actions, testing_regrest, testing_mistakes, testing_payoffs, \
                 testing_conf_intervals, testing_risks = \
-                    model.run(patients, testing_indices, testing_results, i, is_training=False)
+                    model.run(patients, testing_indices, testing_results, i, is_training=False, features=features)
                 # log testing regret, estimated payoff & its confidence interval
                 testing_results.log_results(m, i, testing_actions, testing_regrest, testing_mistakes,
                                             testing_payoffs, testing_conf_intervals, testing_risks)
@@ -252,3 +311,69 @@ def run(patients, models, num_iter=1, trainset_ratio=0.8, verbose=False):
     logging.info(msg)
     if verbose:
         print(msg)
+
+
+def run_online(batches, models, verbose=False):
+    """
+    Run online (training mode only) evaluation of the models on a stream of patient batches.
+    Only the current batch and running totals are held in memory, so that data sets larger
+    than memory can be replayed through the models.
+
+    :param batches: iterable of PatientDataset, e.g. warfarin.stream_data
+    :param models: list of Recommender
+    :param verbose: whether to print progress
+    """
+    logging.info(f"Starting online model training/evaluation with: {len(models)} model(s)")
+
+    np.random.seed(int(time.time()))
+
+    if models is None or len(models) == 0:
+        return
+
+    for model in models:
+        model.reset()
+
+    patient_count = 0
+    total_regrets = np.zeros(len(models))
+    total_mistakes = np.zeros(len(models))
+    total_risks = np.zeros((len(models), 3, 3), dtype=int)
+
+    for b, patients in enumerate(batches):
+        # per batch results, needed by ensemble models which vote on the actions of the other models
+        batch_results = EvalResults(True, models, 1)
+        batch_results.log_truths(0, patients, np.arange(len(patients)))
+        feature_cache = FeatureCache(patients)
+
+        for m in range(len(models)):
+            model = models[m]
+            actions, regrets, mistakes, payoffs, conf_intervals, risks = \
+                model.run(patients, np.arange(len(patients)), batch_results, 0, is_training=True,
+                          features=feature_cache.get(model.feature_set, model.config.sparse_features))
+            batch_results.log_results(m, 0, actions, regrets, mistakes, payoffs, conf_intervals, risks)
+            total_regrets[m] += np.sum(regrets)
+            total_mistakes[m] += np.sum(mistakes)
+            total_risks[m] += risks
+
+        patient_count += len(patients)
+        msg = f"Online batch: {b}, patients: {patient_count}, " + \
+              ", ".join(f"[{models[m].config.algo_name}] err rate: {total_mistakes[m] / patient_count}"
+                        for m in range(len(models)))
+        logging.info(msg)
+        if verbose:
+            print(msg)
+
+    for m in range(len(models)):
+        model_config = models[m].config
+        export_stats_list([total_risks[m].flatten()],
+                          model_config.get_risk_filename(model_config.algo_name, True))
+
+    # compose run summary message
+    msg = f"\n------------------------\n[SUMMARY OF THE ONLINE RUN: {len(models)} model(s), {patient_count} patients]\n"
+    for m in range(len(models)):
+        msg += f"[{models[m].config.algo_name}] " \
+            f"total regret: {total_regrets[m]}, " \
+            f"err rate: {total_mistakes[m] / max(patient_count, 1)}\n"
+
+    logging.info(msg)
+    if verbose:
+        print(msg)
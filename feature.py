@@ -254,3 +254,25 @@ class GenoVKORC1_4451(enum.Enum):
     a_a = 1
     a_c = 2
     c_c = 3
+
+
+# enum type of every categorical property of a Patient
+PROPERTY_ENUMS = {
+    GENDER: Gender,
+    RACE: Race,
+    AGE: AgeGroup,
+    VKORC1_1639: GenoVKORC1_1639,
+    VKORC1_497: GenoVKORC1_497,
+    VKORC1_1173: GenoVKORC1_1173,
+    VKORC1_1542: GenoVKORC1_1542,
+    VKORC1_3730: GenoVKORC1_3730,
+    VKORC1_2255: GenoVKORC1_2255,
+    VKORC1_4451: GenoVKORC1_4451,
+}
+PROPERTY_ENUMS.update({f: BinaryFeature for f in BINARY_FEATURES})
+
+# enum type of every property of a Patient holding a list of enums
+LIST_PROPERTY_ENUMS = {
+    INDICATION: Indication,
+    CYP2C9: GenoCYP2C9,
+}
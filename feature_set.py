@@ -0,0 +1,247 @@
+"""
+Registry of the feature sets used by the recommenders.
+
+A feature set is declared once as a list of feature blocks and compiles into a batched
+encoder, which returns a dense (n_patients, d) float matrix for a batch of patients of a
+PatientDataset. Recommenders select their feature set by name (config.feature_set), and
+the number of features d is derived from the declaration.
+Every block also declares the dataset columns it reads, so that only the columns used by the
+selected recommenders need to be parsed (see FeatureSet.columns).
+"""
+import zlib
+import numpy as np
+import scipy.sparse
+from feature import *
+from encoding import *
+
+# number of hash buckets of the bag of medications
+MEDICATION_HASH_BUCKETS = 32
+
+
+class FeatureBlock:
+    """
+    Block of features computed from the dataset columns by a vectorized function
+    """
+    def __init__(self, names, function, columns):
+        """
+        :param names: feature names of the block
+        :param function: function(dataset, rows) returning (len(rows), width) or (len(rows),) array
+        :param columns: dataset columns read by the function
+        """
+        self.names = list(names)
+        self.width = len(self.names)
+        self.function = function
+        self.columns = list(columns)
+
+    def get_feature_names(self):
+        return self.names
+
+    def encode(self, dataset, rows, out):
+        out[:] = np.reshape(self.function(dataset, rows), (len(rows), self.width))
+        return out
+
+    def encode_coordinates(self, dataset, rows):
+        """
+        :return: positions of the patients in rows, columns and values of the non-zero features
+        """
+        values = np.reshape(self.function(dataset, rows), (len(rows), self.width)).astype(np.float64)
+        patients, columns = np.nonzero(values)
+        return patients, columns, values[patients, columns]
+
+
+def column(name):
+    return lambda dataset, rows: dataset.columns[name][rows]
+
+
+def scaled_column(name, min, max):
+    # same as preprocess.feature_scaling, unknown values are scaled as well
+    return lambda dataset, rows: (dataset.columns[name][rows] - min) / (max - min)
+
+
+def scaled_bmi(dataset, rows):
+    # same as preprocess.get_bmi followed by preprocess.feature_scaling
+    height = dataset.columns[HEIGHT][rows]
+    weight = dataset.columns[WEIGHT][rows]
+    known = (height > 0) & (weight > 0)
+    bmi = np.full(len(rows), float(VAL_UNKNOWN))
+    # python's float ** 2 (libm pow) may differ from numpy's square in the last bit
+    squared = np.fromiter((h ** 2 for h in height[known].tolist()), dtype=np.float64, count=int(known.sum()))
+    bmi[known] = weight[known] * 10000 / squared
+    return (bmi - BMI_MIN) / (BMI_MAX - BMI_MIN)
+
+
+def is_value(name, enum_value):
+    return lambda dataset, rows: dataset.columns[name][rows] == enum_value.value
+
+
+def hashed_medications(buckets):
+    """
+    Bag of the medications listed in the 'Medications' column, hashed into the given number of
+    buckets. The bucket table of a vocabulary is computed once and reused for the next calls with the
+    same vocabulary, so that encoding a single patient does not cost O(vocabulary).
+    """
+    # vocabulary (held to keep its identity valid) -> bucket of every entry, of the last call
+    cache = {"vocab": None, "table": None}
+
+    def get_table(vocab):
+        if cache["vocab"] is not vocab:
+            # crc32 is stable across processes, unlike hash()
+            cache["table"] = np.array([-1 if m is None else zlib.crc32(m.encode("utf-8")) % buckets
+                                       for m in vocab], dtype=np.int64)
+            cache["vocab"] = vocab
+        return cache["table"]
+
+    def function(dataset, rows):
+        table = get_table(dataset.medication_vocab)
+        values, offsets = take_csr(*dataset.lists[MEDICATIONS], rows)
+        patients = np.repeat(np.arange(len(rows)), offsets[1:] - offsets[:-1])
+        columns = table[values]
+        valid = columns >= 0
+        result = np.zeros((len(rows), buckets))
+        result[patients[valid], columns[valid]] = 1
+        return result
+    return function
+
+
+INTERCEPT = FeatureBlock(["Intercept"], lambda dataset, rows: np.ones(len(rows)), [])
+AGE_BLOCK = FeatureBlock([AGE], column(AGE), [AGE])
+# derived flags precomputed at ingest, see ingest.DERIVED_FLAGS
+ENZYME_BLOCK = FeatureBlock(["Enzyme"], column(ENZYME_INDUCER), [ENZYME_INDUCER])
+AMIODARONE_BLOCK = FeatureBlock(["Amiodarone"], column(AMIODARONE), [AMIODARONE])
+BMI_BLOCK = FeatureBlock(["BMI"], scaled_bmi, [HEIGHT, WEIGHT])
+MEDICATION_HASH_BLOCK = FeatureBlock([f"Medication#{i}" for i in range(MEDICATION_HASH_BUCKETS)],
+                                     hashed_medications(MEDICATION_HASH_BUCKETS), [MEDICATIONS])
+
+# covariates of the Warfarin Clinical Dosing Algorithm
+CLINICAL_BLOCKS = [
+    AGE_BLOCK,
+    FeatureBlock([HEIGHT], column(HEIGHT), [HEIGHT]),
+    FeatureBlock([WEIGHT], column(WEIGHT), [WEIGHT]),
+    FeatureBlock(["Asian"], is_value(RACE, Race.asian), [RACE]),
+    FeatureBlock(["African"], is_value(RACE, Race.black), [RACE]),
+    FeatureBlock(["Other"], is_value(RACE, Race.unknown), [RACE]),
+    ENZYME_BLOCK,
+    AMIODARONE_BLOCK,
+]
+
+
+class FeatureSet:
+    """
+    Named list of feature blocks
+    """
+    def __init__(self, name, blocks):
+        self.name = name
+        self.blocks = blocks
+        self.names = [n for b in blocks for n in b.get_feature_names()]
+        self.dim = len(self.names)
+        # dataset columns read by the feature set
+        self.columns = list(dict.fromkeys(c for b in blocks for c in b.columns))
+
+    def encode(self, dataset, rows=None):
+        """
+        Compute the features of the given patients
+
+        :param dataset: PatientDataset
+        :param rows: indices of the patients, all patients if None
+        :return: (len(rows), dim) float matrix
+        """
+        rows = np.arange(len(dataset)) if rows is None else np.asarray(rows, dtype=np.int64)
+        out = np.zeros((len(rows), self.dim))
+        start = 0
+        for b in self.blocks:
+            b.encode(dataset, rows, out[:, start:start + b.width])
+            start += b.width
+        return out
+
+    def encode_sparse(self, dataset, rows=None):
+        """
+        Compute the features of the given patients as a sparse matrix, without materializing
+        the dense one-hot blocks
+
+        :param dataset: PatientDataset
+        :param rows: indices of the patients, all patients if None
+        :return: (len(rows), dim) scipy.sparse CSR matrix
+        """
+        rows = np.arange(len(dataset)) if rows is None else np.asarray(rows, dtype=np.int64)
+        patients, columns, values = [], [], []
+        start = 0
+        for b in self.blocks:
+            block_patients, block_columns, block_values = b.encode_coordinates(dataset, rows)
+            patients.append(block_patients)
+            columns.append(block_columns + start)
+            values.append(block_values)
+            start += b.width
+        matrix = scipy.sparse.csr_matrix((np.concatenate(values), (np.concatenate(patients), np.concatenate(columns))),
+                                         shape=(len(rows), self.dim))
+        matrix.sum_duplicates()
+        return matrix
+
+    def encode_patient(self, patient, sparse=False):
+        """
+        :param patient: Patient
+        :param sparse: whether to return a sparse (1, dim) CSR row
+        :return: feature vector of the given patient
+        """
+        if sparse:
+            return self.encode_sparse(patient.dataset, [patient.index])
+        return self.encode(patient.dataset, [patient.index])[0]
+
+
+# features of the linear bandits
+FULL_BLOCKS = [
+    INTERCEPT,
+    AGE_BLOCK,
+    BMI_BLOCK,
+    FeatureBlock([INR], scaled_column(INR, INR_MIN, INR_MAX), [INR]),
+    FeatureBlock([TARGET_INR], scaled_column(TARGET_INR, INR_MIN, INR_MAX), [TARGET_INR]),
+    BANDIT_ONE_HOT_BLOCK,
+]
+
+FEATURE_SETS = {f.name: f for f in [
+    # features of the Warfarin Clinical Dosing Algorithm, size: 9
+    FeatureSet("clinical", [INTERCEPT] + CLINICAL_BLOCKS),
+    # same as clinical without the intercept, size: 8
+    FeatureSet("basic", CLINICAL_BLOCKS),
+    # size: 1 + 2 + 1 + 3 + 4 + 3 + 3 + 3 = 20
+    FeatureSet("extended", [AGE_BLOCK, ENZYME_BLOCK, AMIODARONE_BLOCK, BMI_BLOCK,
+                            OneHotBlock([GENDER, VKORC1_1639, ASPIRIN, SMOKER, IS_STABLE])]),
+    # size: 5 + 129 = 134
+    FeatureSet("full134", FULL_BLOCKS),
+    # full134 plus the hashed bag of medications, size: 134 + 32 = 166
+    FeatureSet("full134_meds", FULL_BLOCKS + [MEDICATION_HASH_BLOCK]),
+]}
+
+
+def get_feature_set(name):
+    """
+    :param name: name of the feature set
+    :return: FeatureSet
+    """
+    if name not in FEATURE_SETS:
+        raise ValueError(f"Unknown feature set: {name}, expected one of {list(FEATURE_SETS)}")
+    return FEATURE_SETS[name]
+
+
+class FeatureCache:
+    """
+    Feature matrices of a PatientDataset, computed once per feature set (and representation)
+    and shared by all models and iterations using the same feature set
+    """
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.matrices = dict()
+
+    def get(self, feature_set, sparse=False):
+        """
+        :param feature_set: FeatureSet or None
+        :param sparse: whether to return a scipy.sparse CSR matrix
+        :return: (len(dataset), feature_set.dim) matrix, row i holds the features of patient i;
+            None if feature_set is None
+        """
+        if feature_set is None:
+            return None
+        matrix = self.matrices.get((feature_set.name, sparse))
+        if matrix is None:
+            encode = feature_set.encode_sparse if sparse else feature_set.encode
+            matrix = self.matrices[(feature_set.name, sparse)] = encode(self.dataset)
+        return matrix
@@ -0,0 +1,261 @@
+"""
+Incremental decision tree for binary labels, grown from a stream of samples with the Hoeffding bound
+and revised as in the Extremely Fast Decision Tree (EFDT, Hoeffding Anytime Tree).
+
+Every node keeps its class counts and the split statistics of all features: a histogram of the
+class counts over the bins of every feature, of the samples that reached the node since it was
+created. The histograms of a new node are empty, and its class counts are the partition of its
+parent histogram by the split, i.e. the counts of the samples of its region since its parent was
+created. The bin edges of every feature are estimated once from the first samples of the tree (the
+distinct values of the feature, or its quantiles). A sample updates the nodes of its path in O(d)
+each, i.e. O(depth * d), instead of refitting the tree.
+
+A leaf is split on the best (feature, threshold) when its merit (impurity decrease) exceeds the
+Hoeffding bound eps = sqrt(R^2 * ln(1 / delta) / (2 * n)), R the range of the impurity, i.e. when
+splitting is better than not splitting with confidence 1 - delta. An internal node is re-evaluated
+likewise, and its subtree is replaced by a split on a new best (feature, threshold) when the merit of
+the new split exceeds the one of the current split by eps.
+Reference: Manapragada, Chaitanya, Geoffrey I. Webb, and Mahsa Salehi. 2018.
+“Extremely Fast Decision Tree.”
+In Proceedings of the 24th ACM SIGKDD International Conference on Knowledge Discovery & Data Mining,
+1953–62.
+"""
+import math
+import numpy as np
+
+CRITERIA = ["gini", "entropy"]
+
+# range of the impurity of 2 classes
+IMPURITY_RANGE = {"gini": 0.5, "entropy": 1.0}
+
+
+def get_impurity(counts, criterion):
+    """
+    :param counts: (..., 2) class counts
+    :param criterion: "gini" or "entropy"
+    :return: (...) impurities, 0 for no samples
+    """
+    p = counts / np.maximum(counts.sum(axis=-1), 1)[..., None]
+    if criterion == "gini":
+        return 1 - np.sum(p * p, axis=-1)
+    return -np.sum(p * np.log2(np.where(p > 0, p, 1)), axis=-1)
+
+
+class HoeffdingNode:
+    """
+    Node of a HoeffdingTree, a leaf if feature is None
+    """
+    def __init__(self, depth, counts, histogram, start=0):
+        """
+        :param depth: depth of the node, 0 for the root
+        :param counts: class counts of the samples of the node (of its parent split for a new node)
+        :param histogram: d x bins x 2 class counts of the samples seen by the node, per feature and bin
+        :param start: number of samples learned by the tree when the node was created, the histograms
+            of the node cover the samples of its region from there on
+        """
+        self.depth = depth
+        self.start = start
+        self.counts = counts
+        self.histogram = histogram
+        # number of samples in the histogram of every feature
+        self.n = 0
+        # number of samples in the histogram when the split was last evaluated
+        self.evaluated = 0
+        # split: samples with x[feature] <= threshold (bins up to split_bin) go left
+        self.feature = None
+        self.split_bin = None
+        self.threshold = None
+        self.left = None
+        self.right = None
+
+    def get_num_leaves(self):
+        return 1 if self.feature is None else self.left.get_num_leaves() + self.right.get_num_leaves()
+
+
+class HoeffdingTree:
+    """
+    See the module documentation. The knobs follow sklearn.tree.DecisionTreeClassifier where they exist.
+    """
+    def __init__(self, criterion="gini", max_depth=None, min_samples_split=2, min_samples_leaf=1,
+                 max_leaf_nodes=None, split_confidence=1e-3, grace_period=20, num_bins=16):
+        """
+        :param criterion: impurity, one of CRITERIA
+        :param max_depth: maximum depth of the tree, None for no limit
+        :param min_samples_split: minimum number of samples of a node to evaluate a split
+        :param min_samples_leaf: minimum number of samples on each side of a split
+        :param max_leaf_nodes: maximum number of leaves, None for no limit
+        :param split_confidence: delta of the Hoeffding bound
+        :param grace_period: number of samples of a node between evaluations of its split
+        :param num_bins: maximum number of bins of a feature (at least 2), the bin edges are estimated from
+            the first max(min_samples_split, num_bins) samples
+        """
+        if criterion not in CRITERIA:
+            raise ValueError(f"Unknown criterion: {criterion}, expected one of {CRITERIA}")
+        self.criterion = criterion
+        self.max_depth = max_depth
+        self.min_samples_split = min_samples_split
+        self.min_samples_leaf = max(min_samples_leaf, 1)
+        self.max_leaf_nodes = max_leaf_nodes
+        self.split_confidence = split_confidence
+        self.grace_period = grace_period
+        self.num_bins = num_bins
+
+        self.root = HoeffdingNode(0, np.zeros(2), np.zeros((0, num_bins, 2)))
+        self.num_leaves = 1
+        # d x (bins - 1) bin edges of the features, padded with inf, None until estimated
+        self.edges = None
+        # samples seen before the bin edges are estimated
+        self.buffer_x = []
+        self.buffer_y = []
+
+    def _set_edges(self):
+        X = np.array(self.buffer_x)
+        self.edges = np.full((X.shape[1], self.num_bins - 1), np.inf)
+        for j in range(X.shape[1]):
+            values = np.unique(X[:, j])
+            if len(values) > self.num_bins:
+                # inner quantiles
+                edges = np.unique(np.quantile(X[:, j], np.linspace(0, 1, self.num_bins + 1)[1:-1]))
+            else:
+                # midpoints between the distinct values
+                edges = (values[:-1] + values[1:]) / 2
+            self.edges[j, :len(edges)] = edges
+        self.root.histogram = np.zeros((X.shape[1], self.num_bins, 2))
+        self.root.counts = np.zeros(2)
+        self.root.n = 0
+        for x, y in zip(self.buffer_x, self.buffer_y):
+            self.learn(x, y)
+        self.buffer_x, self.buffer_y = [], []
+
+    def get_bins(self, x):
+        """
+        :param x: feature vector
+        :return: bin of every feature
+        """
+        return np.sum(x[:, None] > self.edges, axis=1)
+
+    def get_leaf(self, x):
+        """
+        :param x: feature vector
+        :return: leaf of the sample
+        """
+        node = self.root
+        while node.feature is not None:
+            node = node.left if x[node.feature] <= node.threshold else node.right
+        return node
+
+    def get_counts(self, x):
+        """
+        :param x: feature vector
+        :return: class counts of the leaf of the sample
+        """
+        return self.get_leaf(x).counts
+
+    def learn(self, x, y):
+        """
+        Update the tree with a sample, O(depth * d)
+
+        :param x: feature vector
+        :param y: label, 0 or 1
+        """
+        x = np.asarray(x, dtype=float)
+        if self.edges is None:
+            self.buffer_x.append(x)
+            self.buffer_y.append(y)
+            self.root.counts[y] += 1
+            if len(self.buffer_x) >= max(self.min_samples_split, self.num_bins):
+                self._set_edges()
+            return
+
+        bins = self.get_bins(x)
+        features = np.arange(len(bins))
+        path = []
+        node = self.root
+        while True:
+            node.counts[y] += 1
+            node.histogram[features, bins, y] += 1
+            node.n += 1
+            path.append(node)
+            if node.feature is None:
+                break
+            node = node.left if bins[node.feature] <= node.split_bin else node.right
+
+        for node in path:
+            if node.n - node.evaluated >= self.grace_period and node.n >= self.min_samples_split:
+                node.evaluated = node.n
+                if self._evaluate(node):
+                    # the subtree of the node is replaced, the nodes below are gone
+                    break
+
+    def get_merits(self, node):
+        """
+        :param node: HoeffdingNode
+        :return: d x bins merits (impurity decrease) of the splits of the node after every bin of
+            every feature, -inf for the splits with less than min_samples_leaf samples on a side
+        """
+        left = np.cumsum(node.histogram, axis=1)
+        # class counts of every feature's own histogram
+        totals = left[:, -1]
+        right = totals[:, None] - left
+        n_left, n_right = left.sum(axis=2), right.sum(axis=2)
+        n = np.maximum(totals.sum(axis=1), 1)[:, None]
+        children = (n_left * get_impurity(left, self.criterion) + n_right * get_impurity(right, self.criterion)) / n
+        merits = get_impurity(totals, self.criterion)[:, None] - children
+        return np.where((n_left >= self.min_samples_leaf) & (n_right >= self.min_samples_leaf), merits, -np.inf)
+
+    def _evaluate(self, node):
+        """
+        Split a leaf, or re-split an internal node, when the Hoeffding test passes
+
+        :return: whether the node was (re-)split
+        """
+        is_leaf = node.feature is None
+        if is_leaf and (self.max_depth is not None and node.depth >= self.max_depth
+                        or self.max_leaf_nodes is not None and self.num_leaves >= self.max_leaf_nodes):
+            return False
+        merits = self.get_merits(node)
+        feature, split_bin = np.unravel_index(np.argmax(merits), merits.shape)
+        # merit of not splitting for a leaf, of the current split otherwise
+        current = 0.0 if is_leaf else merits[node.feature, node.split_bin]
+        eps = math.sqrt(IMPURITY_RANGE[self.criterion] ** 2 * math.log(1 / self.split_confidence) / (2 * node.n))
+        if merits[feature, split_bin] - current <= eps or (feature, split_bin) == (node.feature, node.split_bin):
+            return False
+
+        if not is_leaf:
+            self.num_leaves -= node.get_num_leaves() - 1
+        # children with the class counts of the partition of the histogram by the split (used by
+        # get_counts), the counts inherited by the node are not partitioned, and empty split statistics
+        # of all features, so that the statistics of every feature cover the same samples
+        partition = np.cumsum(node.histogram[feature], axis=0)
+        left, right = partition[split_bin], partition[-1] - partition[split_bin]
+        node.feature, node.split_bin = int(feature), int(split_bin)
+        node.threshold = self.edges[feature, split_bin]
+        node.left = HoeffdingNode(node.depth + 1, left, np.zeros_like(node.histogram), self.root.n)
+        node.right = HoeffdingNode(node.depth + 1, right, np.zeros_like(node.histogram), self.root.n)
+        self.num_leaves += 1
+        return True
+
+    def export_graphviz(self, out_file, feature_names=None):
+        """
+        Write the tree in the dot format
+
+        :param out_file: path of the dot file
+        :param feature_names: names of the features, indices if None
+        """
+        lines = ["digraph Tree {", "node [shape=box] ;"]
+        nodes = [(self.root, 0)]
+        next_id = 1
+        while nodes:
+            node, node_id = nodes.pop()
+            label = f"counts = {node.counts.astype(int).tolist()}"
+            if node.feature is not None:
+                name = feature_names[node.feature] if feature_names is not None else f"x[{node.feature}]"
+                label = f"{name} <= {node.threshold:.4g}\\n{label}"
+                for child in [node.left, node.right]:
+                    lines.append(f"{node_id} -> {next_id} ;")
+                    nodes.append((child, next_id))
+                    next_id += 1
+            lines.append(f"{node_id} [label=\"{label}\"] ;")
+        lines.append("}")
+        with open(out_file, "w") as f:
+            f.write("\n".join(lines) + "\n")
@@ -0,0 +1,409 @@
+"""
+Column-oriented ingest of the warfarin csv.
+
+The csv is read into columns of raw strings and every column is parsed in one pass:
+each distinct raw string is parsed only once by the scalar parsers in preprocess.py and
+the result is broadcast to all rows through a lookup table. The parsed data set is a dict
+of column name -> numpy array:
+    - categorical properties as the int8 values of their enums
+    - the dose label as int8, numerical properties as float64
+    - list properties (indications, CYP2C9, medications) as a flat array of values plus
+      offsets into it (CSR layout, offsets are stored as '<column>/offsets'), medications
+      as int32 ids into the vocabulary of the distinct medication strings of the data set
+      (stored as '<column>/vocab')
+    - derived flags (enzyme inducer, amiodarone) as bool, computed once from the medication columns
+Parsing can be restricted to a subset of the columns (column projection), see get_parsed_columns.
+"""
+import csv
+import itertools
+import logging
+import numpy as np
+from feature import *
+from preprocess import *
+
+# missing medication entries (None) are stored as empty strings, which clean_value never returns
+MEDICATION_NONE = ""
+
+# scalar parsers of the categorical columns
+ENUM_PARSERS = {
+    GENDER: parse_gender,
+    RACE: parse_race,
+    AGE: parse_age_group,
+    VKORC1_497: parse_genotype_VKORC1_497,
+    VKORC1_1173: parse_genotype_VKORC1_1173,
+    VKORC1_1542: parse_genotype_VKORC1_1542,
+    VKORC1_3730: parse_genotype_VKORC1_3730,
+    VKORC1_2255: parse_genotype_VKORC1_2255,
+    VKORC1_4451: parse_genotype_VKORC1_4451,
+}
+ENUM_PARSERS.update({f: parse_binary_feature for f in BINARY_FEATURES})
+
+# derived flag -> (binary medication features, medications)
+DERIVED_FLAGS = {
+    ENZYME_INDUCER: (ENZYME_INDUCER_FEATURES, ENZYME_INDUCER_MEDICATIONS),
+    AMIODARONE: (AMIODARONE_FEATURES, AMIODARONE_MEDICATIONS),
+}
+
+# scalar parsers of the columns holding a list of enums
+LIST_PARSERS = {
+    INDICATION: parse_indications,
+    CYP2C9: parse_genotype_CYP2C9,
+}
+
+# all parsed columns
+ALL_COLUMNS = ([DOSE] + NUMERICAL_FEATURES + list(ENUM_PARSERS) + [VKORC1_1639] + list(LIST_PARSERS) +
+               [MEDICATIONS] + list(DERIVED_FLAGS))
+# columns parsed regardless of the projection: the label and the columns checked for missing data
+ESSENTIAL_COLUMNS = [DOSE, AGE, HEIGHT, WEIGHT]
+# columns required to parse a column
+COLUMN_DEPENDENCIES = {
+    VKORC1_1639: [RACE, VKORC1_2255, VKORC1_1173, VKORC1_1542],
+}
+COLUMN_DEPENDENCIES.update({flag: features + [MEDICATIONS] for flag, (features, _) in DERIVED_FLAGS.items()})
+
+# inputs of the VKORC1 -1639 imputation: column, enum type
+IMPUTATION_SOURCES_VKORC1_1639 = [(RACE, Race), (VKORC1_2255, GenoVKORC1_2255), (VKORC1_1173, GenoVKORC1_1173),
+                                  (VKORC1_1542, GenoVKORC1_1542)]
+
+
+def make_imputation_table_VKORC1_1639():
+    """
+    Tabulate preprocess.impute_genotype_VKORC1_1639 over all combinations of its inputs
+
+    :return: table of imputed GenoVKORC1_1639 values indexed by the input values minus min_values, min_values
+    """
+    min_values = np.array([min(e.value for e in enum_type) for _, enum_type in IMPUTATION_SOURCES_VKORC1_1639])
+    shape = [max(e.value for e in enum_type) - m + 1 for (_, enum_type), m in zip(IMPUTATION_SOURCES_VKORC1_1639,
+                                                                                    min_values)]
+    table = np.full(shape, GenoVKORC1_1639.unknown.value, dtype=np.int8)
+    for inputs in itertools.product(*[list(enum_type) for _, enum_type in IMPUTATION_SOURCES_VKORC1_1639]):
+        index = tuple(e.value - m for e, m in zip(inputs, min_values))
+        table[index] = impute_genotype_VKORC1_1639(*inputs).value
+    return table, min_values
+
+
+IMPUTATION_TABLE_VKORC1_1639, IMPUTATION_MIN_VALUES_VKORC1_1639 = make_imputation_table_VKORC1_1639()
+
+# suffixes of the auxiliary arrays of a column
+OFFSETS = "/offsets"
+VOCAB = "/vocab"
+
+
+def get_column_name(key):
+    """
+    :param key: key of the column-oriented data set
+    :return: name of the column the array of the key belongs to
+    """
+    for suffix in (OFFSETS, VOCAB):
+        if key.endswith(suffix):
+            return key[:-len(suffix)]
+    return key
+
+
+def factorize(values):
+    """
+    Encode values as integer codes into the list of their distinct values (in order of appearance)
+
+    :param values: sequence of hashable values
+    :return: codes (numpy array), list of distinct values
+    """
+    uniques = list(dict.fromkeys(values))
+    index = {v: i for i, v in enumerate(uniques)}
+    codes = np.fromiter(map(index.__getitem__, values), dtype=np.int64, count=len(values))
+    return codes, uniques
+
+
+def parse_column(raw, parser, dtype):
+    """
+    Parse a column of raw strings with a scalar parser, calling the parser once per distinct string
+
+    :param raw: sequence of raw strings
+    :param parser: scalar parser
+    :param dtype: numpy dtype of the parsed values
+    :return: parsed column (numpy array)
+    """
+    codes, uniques = factorize(raw)
+    return np.array([parser(u) for u in uniques], dtype=dtype)[codes]
+
+
+def parse_enum_column(raw, parser):
+    return parse_column(raw, lambda s: parser(s).value, np.int8)
+
+
+def parse_list_column(raw, parser, to_value, dtype):
+    """
+    Parse a column of raw strings into a CSR packed column of lists, calling the parser
+    once per distinct string
+
+    :param raw: sequence of raw strings
+    :param parser: scalar parser returning a list
+    :param to_value: conversion of the list items into stored values
+    :param dtype: numpy dtype of the stored values
+    :return: values, offsets
+    """
+    codes, uniques = factorize(raw)
+    values, offsets = make_csr([[to_value(v) for v in parser(u)] for u in uniques], dtype)
+    return take_csr(values, offsets, codes)
+
+
+def intern_list_column(raw, parser):
+    """
+    Parse a column of raw strings into a CSR packed column of lists of ids into the vocabulary
+    of the distinct list items, calling the parser once per distinct string
+
+    :param raw: sequence of raw strings
+    :param parser: scalar parser returning a list of strings (or None)
+    :return: values (int32 ids), offsets, vocabulary (numpy unicode array)
+    """
+    codes, uniques = factorize(raw)
+    lists = [[MEDICATION_NONE if v is None else v for v in parser(u)] for u in uniques]
+    vocab = list(dict.fromkeys(v for l in lists for v in l))
+    index = {v: i for i, v in enumerate(vocab)}
+    values, offsets = make_csr([[index[v] for v in l] for l in lists], np.int32)
+    return take_csr(values, offsets, codes) + (np.array(vocab, dtype=np.str_),)
+
+
+def get_list_membership(columns, name, items):
+    """
+    :param columns: parsed columns with the interned list column
+    :param name: name of the interned list column
+    :param items: list items to look for
+    :return: bool array, whether any of the items is listed for each row
+    """
+    values, offsets = columns[name], columns[name + OFFSETS]
+    ids = np.flatnonzero(np.isin(columns[name + VOCAB], items))
+    rows = np.repeat(np.arange(len(offsets) - 1), offsets[1:] - offsets[:-1])
+    result = np.zeros(len(offsets) - 1, dtype=bool)
+    result[rows[np.isin(values, ids)]] = True
+    return result
+
+
+def derive_flag_column(columns, features, medications):
+    """
+    :param columns: parsed columns with the binary medication features and MEDICATIONS
+    :param features: binary medication features
+    :param medications: medications
+    :return: bool array, whether any of the features is true or any of the medications is listed
+    """
+    result = get_list_membership(columns, MEDICATIONS, medications)
+    for f in features:
+        result |= columns[f] == BinaryFeature.true.value
+    return result
+
+
+def impute_column_VKORC1_1639(columns, raw, return_count=False):
+    """
+    Parse 'VKORC1 -1639 consensus' column and impute missing values from race and the
+    other VKORC1 genotypes with a lookup into IMPUTATION_TABLE_VKORC1_1639 for the whole column
+
+    :param columns: parsed columns with RACE, VKORC1_2255, VKORC1_1173, VKORC1_1542
+    :param raw: sequence of raw strings of the VKORC1 -1639 column
+    :param return_count: whether to return the number of imputed values as well
+    :return: parsed column (numpy array), and the number of imputed values if return_count
+    """
+    # parse without imputation first (imputation from all unknown inputs yields unknown)
+    geno = parse_enum_column(raw, lambda s: parse_genotype_VKORC1_1639(s, Race.unknown, GenoVKORC1_2255.unknown,
+                                                                       GenoVKORC1_1173.unknown,
+                                                                       GenoVKORC1_1542.unknown))
+    missing = geno == GenoVKORC1_1639.unknown.value
+    index = tuple(columns[c][missing].astype(np.int64) - m
+                  for (c, _), m in zip(IMPUTATION_SOURCES_VKORC1_1639, IMPUTATION_MIN_VALUES_VKORC1_1639))
+    imputed = IMPUTATION_TABLE_VKORC1_1639[index]
+    geno[missing] = imputed
+    if return_count:
+        return geno, int(np.count_nonzero(imputed != GenoVKORC1_1639.unknown.value))
+    return geno
+
+
+def get_parsed_columns(selected=None):
+    """
+    Resolve the columns to parse for a column projection: the selected columns, the essential
+    columns and the columns the selected columns are derived from
+
+    :param selected: column names, all columns if None
+    :return: list of column names in the order of ALL_COLUMNS
+    """
+    if selected is None:
+        return list(ALL_COLUMNS)
+    unknown = [c for c in selected if c not in ALL_COLUMNS]
+    if len(unknown) > 0:
+        raise ValueError(f"Unknown columns: {unknown}")
+    required = set(ESSENTIAL_COLUMNS) | set(selected)
+    for c in list(required):
+        required.update(COLUMN_DEPENDENCIES.get(c, []))
+    return [c for c in ALL_COLUMNS if c in required]
+
+
+def parse_columns(raw_columns, keep_missing=False, verbose=True, selected=None):
+    """
+    Parse raw csv columns into the column-oriented data set
+
+    :param raw_columns: dict of column name -> sequence of raw strings
+    :param keep_missing: whether to keep records with missing essential data
+    :param verbose: whether to log the record counts
+    :param selected: columns to parse (see get_parsed_columns), all columns if None
+    :return: dict of column name -> numpy array
+    """
+    parsed = set(get_parsed_columns(selected))
+    columns = dict()
+    columns[DOSE] = parse_column(raw_columns[DOSE], parse_dose, np.int8)
+    for p in NUMERICAL_FEATURES:
+        if p in parsed:
+            columns[p] = parse_column(raw_columns[p], get_float, np.float64)
+    for p, parser in ENUM_PARSERS.items():
+        if p in parsed:
+            columns[p] = parse_enum_column(raw_columns[p], parser)
+    imputed_count = 0
+    if VKORC1_1639 in parsed:
+        columns[VKORC1_1639], imputed_count = impute_column_VKORC1_1639(columns, raw_columns[VKORC1_1639],
+                                                                        return_count=True)
+    for p, parser in LIST_PARSERS.items():
+        if p in parsed:
+            columns[p], columns[p + OFFSETS] = parse_list_column(raw_columns[p], parser, lambda e: e.value, np.int8)
+    if MEDICATIONS in parsed:
+        columns[MEDICATIONS], columns[MEDICATIONS + OFFSETS], columns[MEDICATIONS + VOCAB] = intern_list_column(
+            raw_columns[MEDICATIONS], parse_medications)
+    for p, (features, medications) in DERIVED_FLAGS.items():
+        if p in parsed:
+            columns[p] = derive_flag_column(columns, features, medications)
+
+    raw_count = len(columns[DOSE])
+    if not keep_missing:
+        columns = drop_missing(columns)
+
+    if verbose:
+        logging.info(f"Parsing raw records: loaded record count={raw_count}, "
+                     f"returned patient count={get_row_count(columns)}, keep_missing={keep_missing}, "
+                     f"imputed VKORC1 -1639 count={imputed_count}")
+    return columns
+
+
+def drop_missing(columns):
+    """
+    Filter out records with missing essential data
+
+    :param columns: dict of column name -> numpy array
+    :return: dict of column name -> numpy array
+    """
+    mask = ~((columns[AGE] == AgeGroup.unknown.value) |
+             (columns[HEIGHT] == VAL_UNKNOWN) |
+             (columns[WEIGHT] == VAL_UNKNOWN) |
+             (columns[DOSE] == VAL_UNKNOWN))
+    return take_rows(columns, np.flatnonzero(mask))
+
+
+def get_row_count(columns):
+    return len(columns[DOSE])
+
+
+def take_rows(columns, rows):
+    """
+    Select rows of the column-oriented data set
+
+    :param columns: dict of column name -> numpy array
+    :param rows: indices of the rows to select
+    :return: dict of column name -> numpy array
+    """
+    result = dict()
+    for name, values in columns.items():
+        if name.endswith(OFFSETS):
+            continue
+        if name.endswith(VOCAB):
+            result[name] = values
+        elif name + OFFSETS in columns:
+            result[name], result[name + OFFSETS] = take_csr(values, columns[name + OFFSETS], rows)
+        else:
+            result[name] = values[rows]
+    return result
+
+
+def rows_to_raw_columns(header, rows, names=None):
+    # rows may be shorter than the header
+    width = len(header)
+    rows = [r if len(r) >= width else r + [""] * (width - len(r)) for r in rows]
+    if names is not None:
+        # transpose the projected columns only
+        return {name: [r[i] for r in rows] for i, name in enumerate(header) if name in names}
+    columns = list(zip(*rows)) if len(rows) > 0 else [()] * width
+    # the csv has some empty trailing columns
+    return {name: columns[i] for i, name in enumerate(header) if name}
+
+
+def concat_columns(columns_list):
+    """
+    Concatenate column-oriented data sets
+
+    :param columns_list: list of dict of column name -> numpy array
+    :return: dict of column name -> numpy array
+    """
+    result = dict()
+    for name in columns_list[0]:
+        if name.endswith(OFFSETS) or name.endswith(VOCAB):
+            continue
+        if name + VOCAB in columns_list[0]:
+            # merge the vocabularies, remap the ids into the merged vocabulary
+            vocabs = [c[name + VOCAB].tolist() for c in columns_list]
+            merged = list(dict.fromkeys(v for vocab in vocabs for v in vocab))
+            index = {v: i for i, v in enumerate(merged)}
+            remaps = [np.array([index[v] for v in vocab], dtype=np.int32) for vocab in vocabs]
+            result[name] = np.concatenate([r[c[name]] for r, c in zip(remaps, columns_list)]).astype(np.int32)
+            result[name + VOCAB] = np.array(merged, dtype=np.str_)
+        else:
+            result[name] = np.concatenate([c[name] for c in columns_list])
+        if name + OFFSETS in columns_list[0]:
+            offsets = [c[name + OFFSETS] for c in columns_list]
+            starts = np.cumsum([0] + [o[-1] for o in offsets[:-1]])
+            result[name + OFFSETS] = np.concatenate([offsets[0][:1]] + [o[1:] + s for o, s in zip(offsets, starts)])
+    return result
+
+
+def read_raw_columns(f, names=None):
+    """
+    Read csv file into columns of raw strings
+
+    :param f: file object of the csv
+    :param names: names of the columns to read, all columns if None
+    :return: dict of column name -> sequence of raw strings
+    """
+    reader = csv.reader(f)
+    header = next(reader)
+    return rows_to_raw_columns(header, list(reader), names)
+
+
+def read_raw_column_batches(f, batch_size, names=None):
+    """
+    Read csv file into batches of columns of raw strings, holding only one batch in memory
+
+    :param f: file object of the csv
+    :param batch_size: number of csv rows per batch
+    :param names: names of the columns to read, all columns if None
+    :return: generator of dict of column name -> sequence of raw strings
+    """
+    reader = csv.reader(f)
+    header = next(reader)
+    while True:
+        rows = list(itertools.islice(reader, batch_size))
+        if len(rows) == 0:
+            return
+        yield rows_to_raw_columns(header, rows, names)
+
+
+def parse_column_batches(f, batch_size, keep_missing=False, selected=None):
+    """
+    Parse csv file batch by batch into the column-oriented data set, see parse_columns
+
+    :param f: file object of the csv
+    :param batch_size: number of csv rows per batch (before filtering out missing data)
+    :param keep_missing: whether to keep records with missing essential data
+    :param selected: columns to parse (see get_parsed_columns), all columns if None
+    :return: generator of dict of column name -> numpy array
+    """
+    raw_count, count = 0, 0
+    names = set(get_parsed_columns(selected))
+    for raw_columns in read_raw_column_batches(f, batch_size, names):
+        columns = parse_columns(raw_columns, keep_missing=keep_missing, verbose=False, selected=selected)
+        raw_count += len(raw_columns[DOSE])
+        count += get_row_count(columns)
+        yield columns
+    logging.info(f"Parsing raw records: loaded record count={raw_count}, returned patient count={count}, "
+                 f"keep_missing={keep_missing}")
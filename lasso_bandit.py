@@ -1,7 +1,298 @@
+import scipy.sparse
 from recommender import *
 from preprocess import *
-from sklearn.linear_model import Lasso
-from collections import defaultdict
+from lin_ucb import get_run_results
+
+
+class GramLasso:
+    """
+    Lasso regression with intercept, with the objective of sklearn.linear_model.Lasso:
+        (1 / 2n) * ||y - X * w - intercept||^2 + lambda * ||w||_1
+    The sufficient statistics (n, sum of x, sum of y, sum of y^2, X^T X, X^T y) are updated per sample
+    in O(d^2), and every fit runs coordinate descent on the centered Gram matrix (the intercept is
+    fitted by centering). The cost of an update or a fit does not depend on the number of samples.
+    The stopping criteria are the ones of sklearn.
+
+    The Lasso minimizer is not unique when the features are collinear or outnumber the samples (the
+    one-hot groups of full134 are collinear, its centered features have rank 90 out of 124 non
+    constant ones), and the minimizer found depends on the path of the coordinate descent. By default
+    every fit starts from 0 and sweeps all features in order, as sklearn.linear_model.Lasso does, so
+    that the solution is a deterministic function of the samples and lambda, the one of a sklearn
+    refit up to rounding.
+
+    With warm_start, a fit starts from the previous coefficients and is screened: it needs far fewer
+    sweeps, but can converge to another minimizer, with the same objective value and possibly
+    different predictions for new samples. The coordinate descent runs on a working set: the active
+    set of the previous fit and the features kept by the sequential strong rule
+    |c_j - G_j w| >= 2 * lambda - previous lambda. Features violating the KKT conditions
+    |c_j - G_j w| <= lambda are added until there is none, so that the solution is a minimizer of the
+    fit on all features. Only the columns of the centered Gram matrix of the working set are formed,
+    a fit costs O(d * |working set|) per sweep.
+    Reference: Tibshirani, Robert, et al. 2012.
+    “Strong Rules for Discarding Predictors in Lasso-Type Problems.”
+    Journal of the Royal Statistical Society: Series B 74 (2): 245–66.
+    """
+    def __init__(self, d, tol=1e-4, max_iter=1000, warm_start=False):
+        """
+        :param d: number of features
+        :param tol: tolerance of the coordinate descent, as in sklearn.linear_model.Lasso
+        :param max_iter: maximum number of coordinate descent sweeps per fit
+        :param warm_start: whether a fit starts from the previous coefficients instead of 0
+        """
+        self.tol = tol
+        self.max_iter = max_iter
+        self.warm_start = warm_start
+        self.n = 0
+        self.sum_x = np.zeros(d)
+        self.sum_y = 0.0
+        self.sum_yy = 0.0
+        self.XtX = np.zeros((d, d))
+        self.Xty = np.zeros(d)
+        self.coef_ = np.zeros(d)
+        self.intercept_ = 0.0
+        # regularization parameter of the previous fit, for the sequential strong rule
+        self.lam_ = None
+
+    def add(self, x, y, weight=1):
+        """
+        Add a sample to the sufficient statistics
+
+        :param x: feature vector (dense or sparse CSR row)
+        :param y: target
+        :param weight: weight of the sample, -1 removes a sample added before (see remove)
+        """
+        if scipy.sparse.issparse(x):
+            index, values = x.indices, x.data
+            self.XtX[np.ix_(index, index)] += weight * np.outer(values, values)
+            self.sum_x[index] += weight * values
+            self.Xty[index] += weight * y * values
+        else:
+            self.XtX += weight * np.outer(x, x)
+            self.sum_x += weight * x
+            self.Xty += weight * y * x
+        self.n += weight
+        self.sum_y += weight * y
+        self.sum_yy += weight * y * y
+
+    def remove(self, x, y):
+        """
+        Remove a sample from the sufficient statistics
+
+        :param x: feature vector (dense or sparse CSR row)
+        :param y: target
+        """
+        self.add(x, y, -1)
+
+    def refresh(self, X, y):
+        """
+        Recompute the sufficient statistics from the samples, e.g. to discard the rounding errors
+        accumulated by removals, the coefficients are kept for warm starts
+
+        :param X: n x d feature matrix
+        :param y: n targets
+        """
+        self.n = len(y)
+        self.sum_x = X.sum(axis=0)
+        self.sum_y = y.sum()
+        self.sum_yy = np.dot(y, y)
+        self.XtX = np.dot(X.T, X)
+        self.Xty = np.dot(X.T, y)
+
+    def fit(self, lam):
+        """
+        Fit the coefficients on the samples added so far
+
+        :param lam: regularization parameter
+        :return: self
+        """
+        mean_x = self.sum_x / self.n
+        mean_y = self.sum_y / self.n
+        # covariances of the features and the target, variance of the target and of the features
+        c = self.Xty / self.n - mean_x * mean_y
+        var_y = self.sum_yy / self.n - mean_y * mean_y
+        square_x = np.diag(self.XtX) / self.n
+        var_x = square_x - mean_x * mean_x
+        # features with no variance (up to rounding) have no coefficient, as in sklearn
+        usable = var_x > 1e-12 * square_x
+
+        w = self.coef_
+        w[~usable] = 0
+        if var_y <= 0:
+            # constant target, all coefficients are 0
+            w[:] = 0
+            usable[:] = False
+
+        def gram_columns(index):
+            # d x len(index) columns of the centered Gram matrix
+            return self.XtX[:, index] / self.n - np.outer(mean_x, mean_x[index])
+
+        if self.warm_start:
+            active = np.flatnonzero(w)
+            gradient = c - np.dot(gram_columns(active), w[active])
+            strong = usable & (np.abs(gradient) >= 2 * lam - (lam if self.lam_ is None else self.lam_))
+            working = np.union1d(active, np.flatnonzero(strong))
+        else:
+            # cold start on all features, the path of sklearn
+            w[:] = 0
+            working = np.flatnonzero(usable)
+        while True:
+            G = gram_columns(working)
+            self._descend(working, G[working], c[working], var_y, lam)
+            gradient = c - np.dot(G, w[working])
+            # KKT conditions of the features out of the working set
+            violations = usable & (np.abs(gradient) > lam)
+            violations[working] = False
+            if not violations.any():
+                break
+            working = np.union1d(working, np.flatnonzero(violations))
+        self.intercept_ = mean_y - np.dot(mean_x, w)
+        self.lam_ = lam
+        return self
+
+    def _descend(self, working, G, c, var_y, lam):
+        """
+        Coordinate descent on the coefficients of the working set, the other coefficients are 0
+
+        :param working: indices of the working set
+        :param G: centered Gram matrix of the working set
+        :param c: covariances of the working set features and the target
+        :param var_y: variance of the target
+        :param lam: regularization parameter
+        """
+        w = self.coef_[working]
+        diag = np.diag(G).tolist()
+        gradient = c - np.dot(G, w)
+        for _ in range(self.max_iter if len(w) > 0 else 0):
+            max_w = max_delta = 0.0
+            for j in range(len(w)):
+                w_j = w[j]
+                z = gradient[j] + diag[j] * w_j
+                new = (z - lam if z > lam else z + lam if z < -lam else 0.0) / diag[j]
+                if new != w_j:
+                    # keep the gradient c - G * w up to date
+                    gradient -= (new - w_j) * G[j]
+                    w[j] = new
+                    max_delta = max(max_delta, abs(new - w_j))
+                max_w = max(max_w, abs(new))
+            if max_w == 0 or max_delta / max_w < self.tol:
+                # duality gap, as computed by sklearn for a precomputed Gram matrix (scaled by 1 / n), it is
+                # the one of the full problem once the KKT conditions hold out of the working set
+                cw = np.dot(c, w)
+                residual = var_y - 2 * cw + np.dot(w, c - gradient)
+                dual_norm = np.max(np.abs(gradient))
+                const = lam / dual_norm if dual_norm > lam else 1.0
+                gap = 0.5 * residual * (1 + const ** 2) if dual_norm > lam else residual
+                gap += lam * np.sum(np.abs(w)) - const * (var_y - cw)
+                if gap < self.tol * var_y:
+                    break
+        self.coef_[working] = w
+
+    def get_objective(self, lam):
+        """
+        :param lam: regularization parameter
+        :return: value of the Lasso objective of the coefficients on the samples added so far, with
+            the optimal intercept
+        """
+        mean_x = self.sum_x / self.n
+        mean_y = self.sum_y / self.n
+        G = self.XtX / self.n - np.outer(mean_x, mean_x)
+        c = self.Xty / self.n - mean_x * mean_y
+        var_y = self.sum_yy / self.n - mean_y * mean_y
+        w = self.coef_
+        return 0.5 * (var_y - 2 * np.dot(c, w) + np.dot(w, np.dot(G, w))) + lam * np.sum(np.abs(w))
+
+    def predict(self, x):
+        """
+        :param x: feature vector (dense or sparse CSR row)
+        :return: prediction
+        """
+        if scipy.sparse.issparse(x):
+            return np.dot(self.coef_[x.indices], x.data) + self.intercept_
+        return np.dot(self.coef_, x) + self.intercept_
+
+
+RETENTIONS = ["all", "window", "reservoir"]
+
+# retentions keeping at most a number of samples, which need the samples to evict
+BOUNDED_RETENTIONS = ["window", "reservoir"]
+
+
+class SampleBuffer:
+    """
+    Preallocated buffer of samples (feature vectors and targets) with a bounded retention policy:
+    - "window": the last max_size samples are kept in a ring buffer
+    - "reservoir": a uniform random sample of max_size of the samples seen is kept (reservoir sampling)
+    The capacity is doubled when the buffer is full, up to max_size. With the retention "all" no buffer
+    is needed, the sufficient statistics of GramLasso cover all the samples.
+    """
+    def __init__(self, d, retention, max_size, capacity=64):
+        """
+        :param d: number of features
+        :param retention: retention policy, one of BOUNDED_RETENTIONS
+        :param max_size: maximum number of samples
+        :param capacity: initial number of samples
+        """
+        if retention not in BOUNDED_RETENTIONS:
+            raise ValueError(f"Unknown retention: {retention}, expected one of {BOUNDED_RETENTIONS}")
+        if max_size is None or max_size < 1:
+            raise ValueError(f"Retention {retention} requires a positive max_size, got {max_size}")
+        self.retention = retention
+        self.max_size = max_size
+        # number of retained samples, of samples seen and of evicted samples
+        self.n = 0
+        self.seen = 0
+        self.evictions = 0
+        capacity = min(capacity, max_size)
+        self._X = np.zeros((capacity, d))
+        self._y = np.zeros(capacity)
+
+    @property
+    def X(self):
+        """:return: n x d feature matrix of the retained samples, in no particular order"""
+        return self._X[:self.n]
+
+    @property
+    def y(self):
+        """:return: n targets of the retained samples"""
+        return self._y[:self.n]
+
+    def _grow(self):
+        size = min(len(self._y), self.max_size - len(self._y))
+        self._X = np.concatenate([self._X, np.zeros((size, self._X.shape[1]))])
+        self._y = np.concatenate([self._y, np.zeros(size)])
+
+    def append(self, x, y):
+        """
+        Offer a sample to the buffer
+
+        :param x: feature vector (dense or sparse CSR row)
+        :param y: target
+        :return: whether the sample is retained, and the evicted sample (x, y) or None
+        """
+        self.seen += 1
+        evicted = None
+        if self.n < self.max_size:
+            if self.n == len(self._y):
+                self._grow()
+            slot = self.n
+            self.n += 1
+        else:
+            # the buffer is full, the slot of the sample to replace
+            if self.retention == "window":
+                slot = (self.seen - 1) % self.max_size
+            else:
+                slot = np.random.randint(self.seen)
+                if slot >= self.max_size:
+                    return False, None
+            evicted = self._X[slot].copy(), self._y[slot]
+            self.evictions += 1
+        if scipy.sparse.issparse(x):
+            self._X[slot] = 0
+            self._X[slot, x.indices] = x.data
+        else:
+            self._X[slot] = x
+        self._y[slot] = y
+        return True, evicted
 
 
 class LassoBandit(Recommender):
@@ -44,20 +335,23 @@ class LassoBandit(Recommender):
         # Keep tract of iteration time. This is used to schedule forced arm sampling.
         self.t = 0
 
-        # Arm -> Lasso estimator trained on forced samples.
-        self.force_estimators = {}
+        # Coefficients (K x d) and intercepts (K) of the Lasso estimators of all arms trained on
+        # forced samples, an arm predicts 0 until it has samples.
+        self.force_coef = np.zeros((self.num_arms, self.feature_set.dim))
+        self.force_intercept = np.zeros(self.num_arms)
 
-        # Arm -> Lasso estimator trained on all samples.
-        self.all_estimators = {}
+        # Coefficients and intercepts of the Lasso estimators of all arms trained on all samples.
+        self.all_coef = np.zeros((self.num_arms, self.feature_set.dim))
+        self.all_intercept = np.zeros(self.num_arms)
 
-        # Arm -> iteration where we should force sample an arm.
-        self.force_sample_iter = defaultdict(set)
+        # Arm -> sufficient statistics (GramLasso) of the forced samples / of all samples
+        self.force_statistics = {a: self._get_statistics() for a in range(self.num_arms)}
+        self.all_statistics = {a: self._get_statistics() for a in range(self.num_arms)}
 
-        # Keeps track of past data
-        self.force_sample_X = defaultdict(list)
-        self.force_sample_y = defaultdict(list)
-        self.all_sample_X = defaultdict(list)
-        self.all_sample_y = defaultdict(list)
+        # Keeps track of the retained samples with a bounded retention, arm -> SampleBuffer (None with
+        # the retention "all")
+        self.force_samples = {a: self._get_buffer() for a in range(self.num_arms)}
+        self.all_samples = {a: self._get_buffer() for a in range(self.num_arms)}
 
         # Whether the previous prediction was forced.
         self.forced = False
@@ -66,108 +360,101 @@ class LassoBandit(Recommender):
         self.lambda1 = self.init_lambda1
         self.lambda2 = self.init_lambda2
 
-        # Initialize force sample schedule.
-        for a in range(self.num_arms):
-            K = self.num_arms
-            q = self.q
-            # In the paper the arm starts from 1.
-            i = a + 1
-            for j in range(q * (i - 1) + 1, q * i + 1):
-                for n in range(self.n):
-                    self.force_sample_iter[a].add((2 ** n - 1) * K * q + j)
+    def _get_statistics(self):
+        return GramLasso(self.feature_set.dim, self.config.tol, self.config.max_iter, self.config.warm_start)
 
-    def _train(self, lam, X, y):
-        lasso = Lasso(alpha=lam,)
-        lasso.fit(X, y)
-        return lasso
+    def _get_buffer(self):
+        if self.config.retention not in RETENTIONS:
+            raise ValueError(f"Unknown retention: {self.config.retention}, expected one of {RETENTIONS}")
+        if self.config.retention == "all":
+            return None
+        return SampleBuffer(self.feature_set.dim, self.config.retention, self.config.retention_size)
 
-    def get_features(self, patient):
+    def _add_sample(self, samples, statistics, context_feature, reward):
         """
-        Algorithm-specific feature processing
-
-        :param patient: patient data
-        :return: feature vector for the given patient
+        Add a sample to the sample buffer of an arm and keep the sufficient statistics consistent with
+        the retained samples
         """
+        if samples is None:
+            statistics.add(context_feature, reward)
+            return
+        retained, evicted = samples.append(context_feature, reward)
+        if evicted is not None:
+            statistics.remove(*evicted)
+            # recompute the statistics after every retention_size removals to bound the rounding errors
+            if samples.evictions % samples.max_size == 0:
+                statistics.refresh(samples.X, samples.y)
+                return
+        if retained:
+            statistics.add(context_feature, reward)
+
+    def _train(self, lam, statistics):
+        # refit on the sufficient statistics, see GramLasso
+        return statistics.fit(lam)
 
-        features = list([1, patient.properties[AGE].value])   # size 2
-
-        # features += [patient.properties[f] for f in NUMERICAL_FEATURES]     # size 4
-        # features.append(get_bmi(patient.properties[HEIGHT], patient.properties[WEIGHT]))    # size 1
-        features.append(feature_scaling(BMI_MIN, BMI_MAX, get_bmi(patient.properties[HEIGHT],
-                                                                  patient.properties[WEIGHT])))   # size 1
-        # features.append(feature_scaling(HEIGHT_MIN, HEIGHT_MAX, patient.properties[HEIGHT]))    # size 1
-        # features.append(feature_scaling(WEIGHT_MIN, WEIGHT_MAX, patient.properties[WEIGHT]))    # size 1
-        features.append(feature_scaling(INR_MIN, INR_MAX, patient.properties[INR]))    # size 1
-        features.append(feature_scaling(INR_MIN, INR_MAX, patient.properties[TARGET_INR]))    # size 1
-
-        features += get_one_hot_from_list(patient.properties[INDICATION])   # size: 9
+    def update(self, arm, context_feature, reward):
+        # lazy formatting, the context vector is formatted only if debug logging is enabled
+        logging.debug("[%s] update: action=%s; reward=%s; context=%s", self.config.algo_name, arm, reward,
+                      context_feature)
+        if self.forced:
+            self._add_sample(self.force_samples[arm], self.force_statistics[arm], context_feature, reward)
+            estimator = self._train(self.lambda1, self.force_statistics[arm])
+            self.force_coef[arm], self.force_intercept[arm] = estimator.coef_, estimator.intercept_
+
+        self._add_sample(self.all_samples[arm], self.all_statistics[arm], context_feature, reward)
+        # with a bounded retention the estimators are trained on at most K * retention_size samples, the
+        # schedule stops decaying there
+        t = self.t if self.config.retention == "all" else min(self.t, self.num_arms * self.config.retention_size)
+        self.lambda2 = self.init_lambda2 * np.sqrt(
+            (np.log(t) + np.log(context_feature.shape[-1])) / t)
 
-        features += get_one_hot(patient.properties[GENDER])  # size: 3
-        features += get_one_hot(patient.properties[RACE])  # size: 5
+        estimator = self._train(self.lambda2, self.all_statistics[arm])
+        self.all_coef[arm], self.all_intercept[arm] = estimator.coef_, estimator.intercept_
 
-        for f in BINARY_FEATURES:
-            features += get_one_hot(patient.properties[f]) # size: 23 * 3 = 69
+    def get_force_arms(self, t):
+        """
+        Forced sampling schedule of the paper (arms numbered from 1): arm i is forced at the iterations
+        (2^n - 1) * K * q + j, for n in [0, config.n) and j in [q * (i - 1) + 1, q * i]
 
-        features += get_one_hot_from_list(patient.properties[CYP2C9]) # size: 15
+        :param t: iteration or array of iterations, starting from 1
+        :return: forced arm of every iteration, -1 if the iteration is not forced
+        """
+        period = self.num_arms * self.q
+        # t = (2^n - 1) * K * q + j with j - 1 in [0, K * q)
+        power = (t - 1) // period + 1
+        forced = ((power & (power - 1)) == 0) & (np.log2(power) < self.n)
+        return np.where(forced, (t - 1) % period // self.q, -1)
 
-        for f in VKORC1_GENO_FEATURES:
-            features += get_one_hot(patient.properties[f]) # size: 7 * 4 = 28
+    def _get_force_arm(self, t):
+        # scalar version of get_force_arms
+        period = self.num_arms * self.q
+        power = (t - 1) // period + 1
+        if power & (power - 1) == 0 and power.bit_length() <= self.n:
+            return (t - 1) % period // self.q
+        return None
 
-        return np.array(features)
+    def predict(self, features):
+        """
+        Predicted rewards of all arms by the forced-sample and the all-sample estimators
 
-    def update(self, arm, context_feature, reward):
-        logging.debug(
-            f"[{self.config.algo_name}] update: action={arm}; reward={reward}; context={context_feature}")
-        if self.forced:
-            self.force_sample_X[arm].append(context_feature)
-            self.force_sample_y[arm].append(reward)
-            self.force_estimators[arm] = self._train(
-                self.lambda1,
-                self.force_sample_X[arm],
-                self.force_sample_y[arm]
-            )
-
-        self.all_sample_X[arm].append(context_feature)
-        self.all_sample_y[arm].append(reward)
-        self.lambda2 = self.init_lambda2 * np.sqrt(
-            (np.log(self.t) + np.log(len(context_feature))) / self.t)
+        :param features: dense feature vector, or n x d feature matrix (dense or scipy.sparse)
+        :return: K (n x K for a matrix) forced-sample predictions and all-sample predictions
+        """
+        return features @ self.force_coef.T + self.force_intercept, features @ self.all_coef.T + self.all_intercept
 
-        self.all_estimators[arm] = self._train(
-                self.lambda2,
-                self.all_sample_X[arm],
-                self.all_sample_y[arm]
-            )
+    def select_arms(self, force_predictions, all_predictions):
+        """
+        Best arm by the all-sample predictions among the arms whose forced-sample prediction is within
+        h of the best one, ties go to the lowest arm
 
-    def _get_force_arm(self, t):
-        for a in range(self.num_arms):
-            if t in self.force_sample_iter[a]:
-                return a
-        return None
+        :param force_predictions: K (or n x K) forced-sample predictions, see predict
+        :param all_predictions: K (or n x K) all-sample predictions
+        :return: best arm (or n best arms)
+        """
+        potential = force_predictions >= np.max(force_predictions, axis=-1, keepdims=True) - self.h
+        return np.argmax(np.where(potential, all_predictions, -np.inf), axis=-1)
 
-    def _get_potential_arms(self, features):
-        potential_arms = []
-        predictions = []
-        for a in range(self.num_arms):
-            predictions.append(self.force_estimators[a].predict([features])[0])
-
-        max_pred = np.max(predictions)
-        for a, pred in enumerate(predictions):
-            if pred >= max_pred - self.h:
-                potential_arms.append(a)
-        return potential_arms
-
-    def _get_best_arm(self, potential_arms, features):
-        max_pred = -float("inf")
-        best_arm = -1
-
-        for a in potential_arms:
-            pred = self.all_estimators[a].predict([features])[0]
-            if pred > max_pred:
-                max_pred = pred
-                best_arm = a
-        return best_arm
-
-    def recommend(self, patient, eval_results, iter, patient_idx):
+    def recommend(self, features, eval_results, iter, patient_idx):
         self.t += 1
 
         force_arm = self._get_force_arm(self.t)
@@ -175,9 +462,21 @@ class LassoBandit(Recommender):
             self.forced = True
             return force_arm, None, None
 
-        features = self.get_features(patient)
-        potential_arms = self._get_potential_arms(features)
-        # print("potential arms:", potential_arms)
-
         self.forced = False
-        return self._get_best_arm(potential_arms, features), None, None
+        force_predictions, all_predictions = self.predict(features)
+        # a sparse feature vector is a 1 x d matrix
+        return int(self.select_arms(force_predictions, all_predictions).reshape(-1)[0]), None, None
+
+    def run(self, patients, indices, eval_results, iter, is_training=False, features=None):
+        """
+        See Recommender.run. In testing mode with precomputed features, the model is frozen and the arms
+        of all patients (forced ones included) are selected at once.
+        """
+        if is_training or features is None or len(indices) == 0:
+            return super().run(patients, indices, eval_results, iter, is_training, features)
+        t = self.t + 1 + np.arange(len(indices))
+        self.t += len(indices)
+        force_arms = self.get_force_arms(t)
+        self.forced = bool(force_arms[-1] >= 0)
+        actions = np.where(force_arms >= 0, force_arms, self.select_arms(*self.predict(features[indices])))
+        return get_run_results(actions, patients.labels[indices].astype(int), None, None, self.num_arms)
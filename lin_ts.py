@@ -0,0 +1,101 @@
+import numpy as np
+import scipy.sparse
+import logging
+from lin_ucb import *
+
+
+class LinTSRecommender(DisjointLinearRecommender):
+    """
+    Linear Thompson sampling with disjoint models: the parameters of every arm are sampled from the
+    Gaussian posterior N(theta, v^2 * A^-1) of the ridge regression (the same A and b as LinUCB), and
+    the arm with the highest sampled payoff is recommended.
+
+    Samples are drawn with a cached Cholesky factor L of A^-1 (theta + v * L * eps), which is
+    recomputed in O(d^3) after every factor_interval updates of the arm. With the default interval
+    of d updates (config.factor_interval None), the amortized cost of the factorizations is O(d^2)
+    per update, and a step costs O(K * d^2) as for LinUCB. The posterior mean is always up to date,
+    the posterior covariance used for sampling lags by up to factor_interval updates of the arm.
+    Reference: Agrawal, Shipra, and Navin Goyal. 2013.
+    “Thompson Sampling for Contextual Bandits with Linear Payoffs.”
+    In Proceedings of the 30th International Conference on Machine Learning,
+    127–35. PMLR.
+    """
+    def __init__(self, config):
+        """
+        Args:
+            v: scale of the posterior covariance.
+        """
+        # cached Cholesky factors of A^-1, K x d x d
+        self.L = None
+        # number of updates of each arm since its factor was computed, K
+        self.factor_updates = None
+        super().__init__(config)
+        self.v = self.config.v
+        self.factor_interval = self.d if self.config.factor_interval is None else self.config.factor_interval
+
+    def reset(self):
+        super().reset()
+        self.L = self.invA.copy()
+        self.factor_updates = np.zeros(self.num_arms, dtype=int)
+
+    def update(self, arm, context_feature, reward):
+        super().update(arm, context_feature, reward)
+        self.factor_updates[arm] += 1
+        if self.factor_updates[arm] >= self.factor_interval:
+            self.L[arm] = np.linalg.cholesky(self.invA[arm])
+            self.factor_updates[arm] = 0
+
+    def load_statistics(self, statistics):
+        super().load_statistics(statistics)
+        self.L = np.linalg.cholesky(self.invA)
+        self.factor_updates = np.zeros(self.num_arms, dtype=int)
+
+    def recommend(self, features, eval_results, iter, patient_idx):
+        if features is None:
+            return None, None, None
+
+        # sampled payoffs of all arms: theta_a^T x + v * eps_a^T (L_a^T x)
+        eps = np.random.standard_normal((self.num_arms, self.d))
+        if scipy.sparse.issparse(features):
+            index, values = features.indices, features.data
+            L_x = np.einsum("kij,i->kj", self.L[:, index], values)
+            payoffs = np.dot(self.theta[:, index], values)
+        else:
+            L_x = np.einsum("kij,i->kj", self.L, features)
+            payoffs = np.dot(self.theta, features)
+        payoffs += self.v * np.einsum("kj,kj->k", eps, L_x)
+
+        # ties go to the lowest arm
+        best_arm = int(np.argmax(payoffs))
+        best_payoff = payoffs[best_arm:best_arm + 1]
+
+        logging.debug("[%s] recommend: chosen action=%s; sampled payoff=%s",
+                      self.config.algo_name, best_arm, best_payoff)
+
+        return best_arm, best_payoff, None
+
+    def recommend_batch(self, features):
+        """
+        Recommend arms for a batch of patients with the model frozen, one posterior sample per patient
+
+        :param features: n x d feature matrix (dense or scipy.sparse)
+        :return: (n,) recommended arms, (n,) sampled payoffs of the recommended arms
+        """
+        if scipy.sparse.issparse(features):
+            features = features.toarray()
+        # n x K x d, L_a^T x of every patient and arm
+        L_x = np.matmul(features[:, None, None, :], self.L)[:, :, 0]
+        eps = np.random.standard_normal(L_x.shape)
+        payoffs = np.dot(features, self.theta.T) + self.v * np.einsum("nkj,nkj->nk", eps, L_x)
+        arms = np.argmax(payoffs, axis=1)
+        return arms, payoffs[np.arange(len(arms)), arms]
+
+    def run(self, patients, indices, eval_results, iter, is_training=False, features=None):
+        """
+        See Recommender.run. In testing mode with precomputed features, the posterior samples of
+        all patients are drawn at once (see recommend_batch).
+        """
+        if is_training or features is None:
+            return super().run(patients, indices, eval_results, iter, is_training, features)
+        actions, payoffs = self.recommend_batch(features[indices])
+        return get_run_results(actions, patients.labels[indices].astype(int), payoffs, None, self.num_arms)
@@ -1,4 +1,6 @@
 import numpy as np
+import scipy.sparse
+from scipy.linalg.blas import dger
 import logging
 from recommender import *
 from feature import *
@@ -6,158 +8,475 @@ from constant import *
 from preprocess import *
 
 
-class LinUCBDisjointRecommender(Recommender):
+def get_run_results(actions, labels, payoffs, conf_intervals, num_arms):
     """
-    Linear UCB with disjoint models.
-    Blog post: http://john-maxwell.com/post/2017-03-17/
-    Reference: Li, Lihong, Wei Chu, John Langford, and Robert E Schapire. 2010.
-    “A Contextual-Bandit Approach to Personalized News Article Recommendation.”
-    In Proceedings of the 19th International Conference on World Wide Web,
-    661–70. ACM.
+    Assemble the results of a batch of recommendations in the format of Recommender.run
+
+    :param actions: (n,) recommended arms
+    :param labels: (n,) ground truth arms
+    :param payoffs: (n,) estimated payoffs of the recommended arms, None if not estimated
+    :param conf_intervals: (n,) confidence intervals of the recommended arms, None if not estimated
+    :param num_arms: number of arms
+    :return: lists of actions, regrets, mistakes, payoffs, conf intervals and the risk matrix
+    """
+    correct = actions == labels
+    rewards = np.where(correct, CORRECT_DOSE_REWARD, INCORRECT_DOSE_REWARD)
+    risks = np.bincount(labels * num_arms + actions, minlength=num_arms ** 2).reshape(num_arms, num_arms)
+    # payoffs are reported as 1-element arrays, as by recommend
+    return actions.tolist(), (CORRECT_DOSE_REWARD - rewards).tolist(), (~correct).astype(int).tolist(), \
+        [] if payoffs is None else list(payoffs[:, None]), [] if conf_intervals is None else conf_intervals.tolist(), risks
+
+
+def merge_statistics(statistics):
+    """
+    Merge the sufficient statistics of models trained on disjoint sets of patients by summation,
+    the identity prior of A is not part of the statistics (see export_statistics)
+
+    :param statistics: list of dicts of sufficient statistics
+    :return: dict of the merged sufficient statistics
+    """
+    if len(statistics) == 0:
+        raise ValueError("No statistics to merge")
+    first = statistics[0]
+    for s in statistics[1:]:
+        if s["feature_set"] != first["feature_set"] or s["b"].shape != first["b"].shape:
+            raise ValueError(f"Cannot merge statistics of feature sets {first['feature_set']} {first['b'].shape} "
+                             f"and {s['feature_set']} {s['b'].shape}")
+    return {"feature_set": first["feature_set"],
+            "counts": np.sum([s["counts"] for s in statistics], axis=0),
+            "gram": np.sum([s["gram"] for s in statistics], axis=0),
+            "b": np.sum([s["b"] for s in statistics], axis=0)}
+
+
+def save_statistics(filename, statistics):
+    """
+    Save sufficient statistics (see DisjointLinearRecommender.export_statistics) into a .npz file
+    """
+    with open(filename, "wb") as f:
+        np.savez(f, **statistics)
+
+
+def read_statistics(filename):
+    """
+    :return: sufficient statistics saved by save_statistics
+    """
+    with np.load(filename) as data:
+        statistics = {name: data[name] for name in data.files}
+    statistics["feature_set"] = str(statistics["feature_set"])
+    return statistics
+
+
+class DisjointLinearRecommender(Recommender):
+    """
+    Base class of the bandits with disjoint linear models: ridge regression of the reward of every
+    arm on the features, with the sufficient statistics A = D^T * D + I and b = D^T * r per arm.
+    Subclasses implement recommend.
     """
+    supports_merge = True
+
     def __init__(self, config):
         """
         Args:
-            alpha: regularization parameter.
             d: number of features
             num_arms: number of arms
         """
         super().__init__(config)
-        self.alpha = self.config.alpha
-        self.d = self.config.feature_count
+        self.d = self.feature_set.dim
         self.num_arms = len(self.config.actions)
 
-        # Convenience variable.
+        # Per arm state, stacked along the first axis (arm).
         # A = D^T * D + I
         # where D is the num_observation * d design matrix
-        # action -> d * d.
-        self.A = {}
+        # K x d x d
+        self.A = None
+        # A^-1, maintained by rank-1 updates, K x d x d
+        self.invA = None
+        # number of updates of each arm since A^-1 was last computed from A, K
+        self.updates = None
+        # number of observations of each arm, K
+        self.counts = None
 
         # Learned params
-        # action -> d
-        self.theta = {}
-        self.b = {}
+        # theta = A^-1 * b, refreshed for the updated arm only, K x d
+        self.theta = None
+        self.b = None
         self.reset()
 
     def reset(self):
         logging.debug(f"[{self.config.algo_name}] reset!")
-        for a in range(self.num_arms):
-            self.A[a] = np.identity(self.d)               # d x d
-            self.b[a] = np.atleast_2d(np.zeros(self.d)).T # d x 1
+        self.A = np.tile(np.identity(self.d), (self.num_arms, 1, 1))
+        self.invA = self.A.copy()
+        self.b = np.zeros((self.num_arms, self.d))
+        self.theta = np.zeros((self.num_arms, self.d))
+        self.updates = np.zeros(self.num_arms, dtype=int)
+        self.counts = np.zeros(self.num_arms, dtype=int)
+
+    def update(self, arm, context_feature, reward):
+        # lazy formatting, the context vector is formatted only if debug logging is enabled
+        logging.debug("[%s] update: action=%s; reward=%s; context=%s", self.config.algo_name, arm, reward,
+                      context_feature)
+        invA = self.invA[arm]
+        if scipy.sparse.issparse(context_feature):
+            # rank-1 update of the non-zero coordinates only
+            index, values = context_feature.indices, context_feature.data
+            self.A[arm][np.ix_(index, index)] += np.outer(values, values)
+            self.b[arm, index] += reward * values
+            invA_x = np.dot(invA[:, index], values)
+            x_invA_x = np.dot(values, invA_x[index])
+        else:
+            self.A[arm] += np.outer(context_feature, context_feature)
+            self.b[arm] += reward * context_feature
+            invA_x = np.dot(invA, context_feature)
+            x_invA_x = np.dot(context_feature, invA_x)
+
+        self.counts[arm] += 1
+        self.updates[arm] += 1
+        if 0 < self.config.refactor_interval <= self.updates[arm]:
+            # exact refactorization, bounds the drift of the incremental updates
+            invA[:] = np.linalg.inv(self.A[arm])
+            self.updates[arm] = 0
+        else:
+            # Sherman-Morrison: (A + x x^T)^-1 = A^-1 - A^-1 x x^T A^-1 / (1 + x^T A^-1 x), A^-1 is symmetric
+            invA -= np.outer(invA_x, invA_x / (1 + x_invA_x))
+        self.theta[arm] = np.dot(invA, self.b[arm])
+
+    def export_statistics(self):
+        """
+        Export the sufficient statistics of the model, without the identity prior of A, so that the
+        statistics of models trained on disjoint sets of patients can be merged (see merge_statistics)
+
+        :return: dict with the feature set name, the number of observations of every arm (K), the
+            upper triangles of the symmetric Gram matrices A - I (K x d(d+1)/2) and b (K x d)
+        """
+        rows, columns = np.triu_indices(self.d)
+        return {"feature_set": self.feature_set.name, "counts": self.counts.copy(),
+                "gram": (self.A - np.identity(self.d))[:, rows, columns], "b": self.b.copy()}
+
+    def load_statistics(self, statistics):
+        """
+        Replace the state of the model by the given sufficient statistics (see export_statistics),
+        A^-1 and theta are computed from A = I + Gram matrix
 
-    def get_features(self, patient):
+        :param statistics: dict of sufficient statistics, e.g. merged by merge_statistics
         """
-        Algorithm-specific feature processing
+        if statistics["feature_set"] != self.feature_set.name or statistics["b"].shape != self.b.shape:
+            raise ValueError(f"Statistics of feature set {statistics['feature_set']} {statistics['b'].shape} "
+                             f"do not match the model: {self.feature_set.name} {self.b.shape}")
+        rows, columns = np.triu_indices(self.d)
+        self.A = np.tile(np.identity(self.d), (self.num_arms, 1, 1))
+        self.A[:, rows, columns] += statistics["gram"]
+        self.A[:, columns, rows] = self.A[:, rows, columns]
+        self.b = np.array(statistics["b"], dtype=float)
+        self.counts = np.array(statistics["counts"])
+        self.invA = np.linalg.inv(self.A)
+        self.theta = np.einsum("kij,kj->ki", self.invA, self.b)
+        self.updates = np.zeros(self.num_arms, dtype=int)
 
-        :param patient: patient data
-        :return: feature vector for the given patient
+    @staticmethod
+    def merge_statistics(statistics):
+        return merge_statistics(statistics)
+
+
+class LinUCBDisjointRecommender(DisjointLinearRecommender):
+    """
+    Linear UCB with disjoint models.
+    Blog post: http://john-maxwell.com/post/2017-03-17/
+    Reference: Li, Lihong, Wei Chu, John Langford, and Robert E Schapire. 2010.
+    “A Contextual-Bandit Approach to Personalized News Article Recommendation.”
+    In Proceedings of the 19th International Conference on World Wide Web,
+    661–70. ACM.
+    """
+    def __init__(self, config):
+        """
+        Args:
+            alpha: regularization parameter.
         """
-        # missing values, we can't apply the algorithm
-        # if patient.properties[DOSE] == VAL_UNKNOWN or \
-        #     patient.properties[AGE].value == AgeGroup.unknown or \
-        #     patient.properties[HEIGHT] == VAL_UNKNOWN or \
-        #     patient.properties[WEIGHT] == VAL_UNKNOWN:
-        #     return None
-        #
-        features = list([1, patient.properties[AGE].value])   # size 2
+        super().__init__(config)
+        self.alpha = self.config.alpha
+
+    def recommend(self, features, eval_results, iter, patient_idx):
+        if features is None:
+            return None, None, None
 
-        # features += [patient.properties[f] for f in NUMERICAL_FEATURES]     # size 4
-        # features.append(get_bmi(patient.properties[HEIGHT], patient.properties[WEIGHT]))    # size 1
-        features.append(feature_scaling(BMI_MIN, BMI_MAX, get_bmi(patient.properties[HEIGHT],
-                                                                  patient.properties[WEIGHT])))   # size 1
-        # features.append(feature_scaling(HEIGHT_MIN, HEIGHT_MAX, patient.properties[HEIGHT]))    # size 1
-        # features.append(feature_scaling(WEIGHT_MIN, WEIGHT_MAX, patient.properties[WEIGHT]))    # size 1
-        features.append(feature_scaling(INR_MIN, INR_MAX, patient.properties[INR]))    # size 1
-        features.append(feature_scaling(INR_MIN, INR_MAX, patient.properties[TARGET_INR]))    # size 1
+        # payoffs and confidence intervals of all arms at once
+        if scipy.sparse.issparse(features):
+            # quadratic forms and payoffs over the non-zero coordinates only
+            index, values = features.indices, features.data
+            invA = self.invA[:, index[:, None], index]
+            conf_intervals = self.alpha * np.sqrt(np.einsum("i,kij,j->k", values, invA, values))
+            payoffs = np.dot(self.theta[:, index], values) + conf_intervals
+        else:
+            conf_intervals = self.alpha * np.sqrt(np.einsum("kij,i,j->k", self.invA, features, features))
+            payoffs = np.dot(self.theta, features) + conf_intervals
 
-        features += get_one_hot_from_list(patient.properties[INDICATION])   # size: 9
+        # ties go to the lowest arm
+        best_arm = int(np.argmax(payoffs))
+        # the payoff is reported as a 1-element array, as in the results files so far
+        best_payoff = payoffs[best_arm:best_arm + 1]
+        best_conf_interval = conf_intervals[best_arm]
 
-        features += get_one_hot(patient.properties[GENDER])  # size: 3
-        features += get_one_hot(patient.properties[RACE])  # size: 5
+        logging.debug("[%s] recommend: chosen action=%s; estimated payoff=%s; conf interval=%s",
+                      self.config.algo_name, best_arm, best_payoff, best_conf_interval)
 
-        for f in BINARY_FEATURES:
-            features += get_one_hot(patient.properties[f]) # size: 23 * 3 = 69
+        return best_arm, best_payoff, best_conf_interval
 
-        features += get_one_hot_from_list(patient.properties[CYP2C9]) # size: 15
+    def reset_replicas(self, num_replicas, alphas=None):
+        """
+        Reset the state of num_replicas independent copies of the model (replicas), which are
+        trained and evaluated in lockstep by run_replicas. The state of the replicas is stacked
+        along the first axis, the state of the model itself (see reset) is not touched.
 
-        for f in VKORC1_GENO_FEATURES:
-            features += get_one_hot(patient.properties[f]) # size: 7 * 4 = 28
+        :param num_replicas: number of replicas
+        :param alphas: exploration parameter of every replica, config.alpha for all replicas if None
+        """
+        shape = (num_replicas, self.num_arms)
+        self.replica_alphas = np.full(num_replicas, self.alpha, dtype=float) if alphas is None \
+            else np.asarray(alphas, dtype=float)
+        # R x K x d x d
+        self.replica_invA = np.tile(np.identity(self.d), shape + (1, 1))
+        # A is needed for refactorization only
+        self.replica_A = self.replica_invA.copy() if self.config.refactor_interval > 0 else None
+        # R x K x d
+        self.replica_b = np.zeros(shape + (self.d,))
+        self.replica_theta = np.zeros(shape + (self.d,))
+        # R x K
+        self.replica_updates = np.zeros(shape, dtype=int)
 
-        return np.array(features)
+    def update_replicas(self, arms, context_features, rewards, invA_x, x_invA_x):
+        """
+        Observe the rewards of the recommended arms of all replicas
 
-    def update(self, arm, context_feature, reward):
-        logging.debug(f"[{self.config.algo_name}] update: action={arm}; reward={reward}; context={context_feature}")
-        self.A[arm] += np.outer(context_feature, context_feature)
-        self.b[arm] += reward * np.reshape(context_feature, (self.d, 1))
-
-    def recommend(self, patient, eval_results, iter, patient_idx):
-        payoff = {}
-        best_arm = None
-        best_payoff = -float('inf')
-        best_conf_interval = None
-
-        fvec = self.get_features(patient)
-        if fvec is None:
-            return None, None, None
+        :param arms: (R,) recommended arm of every replica
+        :param context_features: (R, d) context of every replica
+        :param rewards: (R,) reward of every replica
+        :param invA_x: (R, d) A^-1 * x of the recommended arms (before the update)
+        :param x_invA_x: (R,) x^T * A^-1 * x of the recommended arms (before the update)
+        """
+        replicas = np.arange(len(arms))
+        self.replica_b[replicas, arms] += rewards[:, None] * context_features
+        # recursive least squares: theta' = theta + A'^-1 * x * (r - x^T * theta)
+        #                                  = theta + A^-1 * x * (r - x^T * theta) / (1 + x^T * A^-1 * x)
+        theta = self.replica_theta[replicas, arms]
+        errors = rewards - np.einsum("rd,rd->r", theta, context_features)
+        self.replica_theta[replicas, arms] = theta + invA_x * (errors / (1 + x_invA_x))[:, None]
+
+        # in place rank-1 updates (BLAS ger) of the recommended arms only, A^-1 and A are symmetric
+        # so the transposed (Fortran ordered) views are updated
+        invA = self.replica_invA.reshape(-1, self.d, self.d)
+        A = self.replica_A.reshape(-1, self.d, self.d) if self.replica_A is not None else None
+        for r, i in enumerate(replicas * self.num_arms + arms):
+            dger(-1 / (1 + x_invA_x[r]), invA_x[r], invA_x[r], a=invA[i].T, overwrite_a=True)
+            if A is not None:
+                dger(1.0, context_features[r], context_features[r], a=A[i].T, overwrite_a=True)
+
+        self.replica_updates[replicas, arms] += 1
+        if self.config.refactor_interval > 0:
+            for r, a in zip(*np.nonzero(self.replica_updates >= self.config.refactor_interval)):
+                self.replica_invA[r, a] = np.linalg.inv(self.replica_A[r, a])
+                self.replica_theta[r, a] = np.dot(self.replica_invA[r, a], self.replica_b[r, a])
+                self.replica_updates[r, a] = 0
 
-        for a in range(self.num_arms):
-            invA = np.linalg.inv(self.A[a])
-            self.theta[a] = np.dot(invA, self.b[a])
-            conf_interval = self.alpha * np.sqrt(np.dot(fvec.T, np.dot(invA, fvec)))
+    def run_replicas(self, patients, indices, is_training=False, features=None):
+        """
+        Run the replicas (see reset_replicas) in lockstep: step t recommends an arm for the t-th
+        patient of every replica with one batched scoring of all replicas and arms, and updates
+        the recommended arms in training mode. In testing mode the replicas are frozen, so all
+        patients of a replica are scored at once.
 
-            payoff[a] = (np.dot(self.theta[a].T, fvec)) + conf_interval
+        :param patients: complete patient data set
+        :param indices: (R, n) indices into the patient data set, row r for replica r
+        :param is_training: whether to run the replicas in training mode (which updates weights)
+        :param features: optional precomputed feature matrix of the model's feature set for the
+            complete patient data set (see FeatureCache)
+        :return: list with the results of every replica, in the format of Recommender.run
+        """
+        indices = np.asarray(indices)
+        num_replicas, n = indices.shape
+        if features is None:
+            features = self.feature_set.encode(patients)
+        elif scipy.sparse.issparse(features):
+            features = features.toarray()
+        labels = patients.labels.astype(int)[indices]
+        alphas = self.replica_alphas
 
-            if payoff[a] > best_payoff:
-                best_payoff = payoff[a]
-                best_arm = a
-                best_conf_interval = conf_interval
+        if is_training:
+            actions = np.zeros((num_replicas, n), dtype=int)
+            payoffs = np.zeros((num_replicas, n))
+            conf_intervals = np.zeros((num_replicas, n))
+            replicas = np.arange(num_replicas)
+            for t in range(n):
+                x = features[indices[:, t]]
+                # R x K x d
+                invA_x = np.matmul(self.replica_invA, x[:, None, :, None])[..., 0]
+                x_invA_x = np.einsum("rkd,rd->rk", invA_x, x)
+                conf = alphas[:, None] * np.sqrt(x_invA_x)
+                payoff = np.einsum("rkd,rd->rk", self.replica_theta, x) + conf
 
-        logging.debug(f"[{self.config.algo_name}] recommend: chosen action={best_arm}; "
-                          f"estimated payoff={best_payoff}; conf interval={best_conf_interval}")
+                # ties go to the lowest arm
+                arms = np.argmax(payoff, axis=1)
+                actions[:, t] = arms
+                payoffs[:, t] = payoff[replicas, arms]
+                conf_intervals[:, t] = conf[replicas, arms]
+                rewards = np.where(arms == labels[:, t], CORRECT_DOSE_REWARD, INCORRECT_DOSE_REWARD)
+                self.update_replicas(arms, x, rewards, invA_x[replicas, arms], x_invA_x[replicas, arms])
+        else:
+            actions, payoffs, conf_intervals = [], [], []
+            for r in range(num_replicas):
+                x = features[indices[r]]
+                # K x n x d, A^-1 is symmetric
+                invA_x = np.matmul(x, self.replica_invA[r])
+                conf = alphas[r] * np.sqrt(np.einsum("knd,nd->kn", invA_x, x))
+                payoff = np.matmul(self.replica_theta[r], x.T) + conf
+                arms = np.argmax(payoff, axis=0)
+                actions.append(arms)
+                payoffs.append(payoff[arms, np.arange(n)])
+                conf_intervals.append(conf[arms, np.arange(n)])
 
-        return best_arm, best_payoff, best_conf_interval
+        return [get_run_results(actions[r], labels[r], payoffs[r], conf_intervals[r], self.num_arms)
+                for r in range(num_replicas)]
 
 
 class LinUCBDisjointBasicRecommender(LinUCBDisjointRecommender):
     """
     Linear UCB with disjoint model using the same feature set as
-    Clinical_Dose model
+    Clinical_Dose model (see ConfigLinUCBDisjointBasic)
+    """
+
+
+class LinUCBHybridRecommender(Recommender):
+    """
+    Linear UCB with hybrid models: the payoff of arm a is z_a^T * beta + x^T * theta_a, where beta
+    is shared by all arms and theta_a is specific to arm a (Algorithm 2 of the reference below).
+    x is the feature vector of the patient, and the shared features z_a of arm a are the features
+    of config.shared_features scaled by the centered ordinal of the arm (-1, 0, 1 for low, medium
+    and high dose), so that beta models the covariate effects on the dose common to all arms.
+
+    The inverses of A_0 and A_a, C_a = A_a^-1 * B_a and A_a^-1 * b_a are updated incrementally,
+    every update is O(d^2 + d * k + k^2) for d features and k shared features. Sparse feature rows
+    (config.sparse_features) are densified, in O(d).
+    Reference: Li, Lihong, Wei Chu, John Langford, and Robert E Schapire. 2010.
+    “A Contextual-Bandit Approach to Personalized News Article Recommendation.”
+    In Proceedings of the 19th International Conference on World Wide Web,
+    661–70. ACM.
     """
     def __init__(self, config):
-        """
-        Args:
-            alpha: regularization parameter.
-            d: number of features
-            num_arms: number of arms
-        """
         super().__init__(config)
         self.alpha = self.config.alpha
-        self.d = self.config.feature_count
+        self.d = self.feature_set.dim
+        self.num_arms = len(self.config.actions)
+        # positions of the shared features in the feature vector
+        names = self.feature_set.names
+        self.shared_index = np.arange(self.d) if self.config.shared_features is None \
+            else np.array([names.index(name) for name in self.config.shared_features])
+        self.k = len(self.shared_index)
+        # centered ordinal of every arm
+        self.arm_ordinals = np.arange(self.num_arms) - (self.num_arms - 1) / 2
+
+        # shared state: A_0 (k x k), its inverse, b_0 (k) and beta = A_0^-1 * b_0
+        self.A0 = None
+        self.invA0 = None
+        self.b0 = None
+        self.beta = None
+
+        # per arm state, stacked along the first axis (arm)
+        # A_a: K x d x d, A_a^-1: K x d x d, b_a: K x d, B_a: K x d x k
+        self.A = None
+        self.invA = None
+        self.b = None
+        self.B = None
+        # C_a = A_a^-1 * B_a: K x d x k, h_a = A_a^-1 * b_a: K x d
+        self.C = None
+        self.h = None
+        # number of updates of each arm since the inverses were last computed from A_0 and A_a, K
+        self.updates = None
+        self.reset()
 
+    def reset(self):
+        logging.debug(f"[{self.config.algo_name}] reset!")
+        self.A0 = np.identity(self.k)
+        self.invA0 = np.identity(self.k)
+        self.b0 = np.zeros(self.k)
+        self.beta = np.zeros(self.k)
+        self.A = np.tile(np.identity(self.d), (self.num_arms, 1, 1))
+        self.invA = self.A.copy()
+        self.b = np.zeros((self.num_arms, self.d))
+        self.B = np.zeros((self.num_arms, self.d, self.k))
+        self.C = np.zeros((self.num_arms, self.d, self.k))
+        self.h = np.zeros((self.num_arms, self.d))
+        self.updates = np.zeros(self.num_arms, dtype=int)
 
-    def get_features(self, patient):
+    def get_dense(self, context_feature):
         """
-        Algorithm-specific feature processing
+        :param context_feature: feature vector of the patient (dense or sparse CSR row)
+        :return: dense feature vector
+        """
+        return context_feature.toarray()[0] if scipy.sparse.issparse(context_feature) else context_feature
 
-        :param patient: patient data
-        :return: feature vector for the given patient
+    def get_shared_features(self, context_feature):
+        """
+        :param context_feature: feature vector of the patient
+        :return: K x k shared features of all arms
         """
-        enzyme = 1 if patient.properties[TEGRETOL] is BinaryFeature.true or \
-                      patient.properties[DILANTIN] is BinaryFeature.true or \
-                      patient.properties[RIFAMPIN] is BinaryFeature.true or \
-                      any(m in patient.properties[MEDICATIONS] for m in ["carbamazepine", "phenytoin", "rifampin",
-                                                                         "rifampicin"]) \
-                else 0
+        return self.arm_ordinals[:, None] * context_feature[self.shared_index]
+
+    def update(self, arm, context_feature, reward):
+        logging.debug("[%s] update: action=%s; reward=%s; context=%s", self.config.algo_name, arm, reward,
+                      context_feature)
+        x = self.get_dense(context_feature)
+        z = self.get_shared_features(x)[arm]
+        invA = self.invA[arm]
+        invA_x = np.dot(invA, x)
+        denominator = 1 + np.dot(x, invA_x)
+        # the update of A_0 by Algorithm 2 (A_0 += B_a^T A_a^-1 B_a before and -= after the update of the
+        # arm, += z z^T) reduces to the rank-1 update A_0 += v v^T / denominator, with v = z - C_a^T x,
+        # and the update of b_0 to b_0 += v * error / denominator
+        v = z - np.dot(x, self.C[arm])
+        error = reward - np.dot(x, self.h[arm])
+
+        self.A[arm] += np.outer(x, x)
+        self.B[arm] += np.outer(x, z)
+        self.b[arm] += reward * x
+        self.A0 += np.outer(v, v / denominator)
+        self.b0 += v * (error / denominator)
+
+        self.updates[arm] += 1
+        if 0 < self.config.refactor_interval <= self.updates[arm]:
+            # exact refactorization, bounds the drift of the incremental updates
+            invA[:] = np.linalg.inv(self.A[arm])
+            self.C[arm] = np.dot(invA, self.B[arm])
+            self.h[arm] = np.dot(invA, self.b[arm])
+            self.invA0 = np.linalg.inv(self.A0)
+            self.updates[arm] = 0
+        else:
+            # Sherman-Morrison
+            invA -= np.outer(invA_x, invA_x / denominator)
+            self.C[arm] += np.outer(invA_x, v / denominator)
+            self.h[arm] += invA_x * (error / denominator)
+            invA0_v = np.dot(self.invA0, v)
+            self.invA0 -= np.outer(invA0_v, invA0_v / (denominator + np.dot(v, invA0_v)))
+        self.beta = np.dot(self.invA0, self.b0)
 
-        amiodarone = 1 if patient.properties[CORDARONE] is BinaryFeature.true or \
-                         "amiodarone" in patient.properties[MEDICATIONS] \
-                    else 0
+    def recommend(self, features, eval_results, iter, patient_idx):
+        if features is None:
+            return None, None, None
+
+        x = self.get_dense(features)
+        z = self.get_shared_features(x)
+        # K x k, v_a = z_a - C_a^T x
+        v = z - np.einsum("kdj,d->kj", self.C, x)
+        # s_a = z_a^T A_0^-1 z_a - 2 z_a^T A_0^-1 C_a^T x + x^T A_a^-1 x + x^T C_a A_0^-1 C_a^T x
+        #     = v_a^T A_0^-1 v_a + x^T A_a^-1 x
+        s = np.einsum("ki,ij,kj->k", v, self.invA0, v) + np.einsum("kij,i,j->k", self.invA, x, x)
+        conf_intervals = self.alpha * np.sqrt(s)
+        # z_a^T beta + x^T theta_a, theta_a = A_a^-1 (b_a - B_a beta) = h_a - C_a beta
+        payoffs = np.dot(v, self.beta) + np.dot(self.h, x) + conf_intervals
 
-        features = [1, patient.properties[AGE].value, patient.properties[HEIGHT], patient.properties[WEIGHT],
-                    1 if patient.properties[RACE] is Race.asian else 0,
-                    1 if patient.properties[RACE] is Race.black else 0,
-                    1 if patient.properties[RACE] is Race.unknown else 0,
-                    enzyme, amiodarone]
+        # ties go to the lowest arm
+        best_arm = int(np.argmax(payoffs))
+        best_payoff = payoffs[best_arm:best_arm + 1]
+        best_conf_interval = conf_intervals[best_arm]
 
-        return np.array(features)
+        logging.debug("[%s] recommend: chosen action=%s; estimated payoff=%s; conf interval=%s",
+                      self.config.algo_name, best_arm, best_payoff, best_conf_interval)
 
+        return best_arm, best_payoff, best_conf_interval
@@ -1,11 +1,31 @@
+import collections.abc
 from feature import *
-from preprocess import *
-from util import *
+
+
+class PatientProperties(collections.abc.Mapping):
+    """
+    Read-only dict-like access to the parsed properties of a patient (column name -> value),
+    decoding the compact codes stored in PatientDataset into enums / floats / lists on access
+    """
+    __slots__ = ("dataset", "index")
+
+    def __init__(self, dataset, index):
+        self.dataset = dataset
+        self.index = index
+
+    def __getitem__(self, name):
+        return self.dataset.get_value(name, self.index)
+
+    def __iter__(self):
+        return iter(self.dataset.property_names)
+
+    def __len__(self):
+        return len(self.dataset.property_names)
 
 
 class Patient:
     """
-    Class to represent a patient
+    Class to represent a patient: a light-weight view of one row of PatientDataset
     ------------------------------------------------
     Gender *
     Race *
@@ -51,29 +71,13 @@ class Patient:
     VKORC1 -4451 consensus *
     ------------------------------------------------
     """
-    def __init__(self, record):
-        self.properties = dict()
-        self.properties[DOSE] = parse_dose(record[DOSE])
-        self.properties[GENDER] = parse_gender(record[GENDER])
-        self.properties[RACE] = parse_race(record[RACE])
-        self.properties[AGE] = parse_age_group(record[AGE])
-        for p in NUMERICAL_FEATURES:
-            self.properties[p] = get_float(record[p])
-        self.properties[INDICATION] = parse_indications(record[INDICATION])
-        for p in BINARY_FEATURES:
-            self.properties[p] = parse_binary_feature(record[p])
-        self.properties[MEDICATIONS] = parse_medications(record[MEDICATIONS])
-        self.properties[CYP2C9] = parse_genotype_CYP2C9(record[CYP2C9])
-        self.properties[VKORC1_497] = parse_genotype_VKORC1_497(record[VKORC1_497])
-        self.properties[VKORC1_1173] = parse_genotype_VKORC1_1173(record[VKORC1_1173])
-        self.properties[VKORC1_1542] = parse_genotype_VKORC1_1542(record[VKORC1_1542])
-        self.properties[VKORC1_3730] = parse_genotype_VKORC1_3730(record[VKORC1_3730])
-        self.properties[VKORC1_2255] = parse_genotype_VKORC1_2255(record[VKORC1_2255])
-        self.properties[VKORC1_4451] = parse_genotype_VKORC1_4451(record[VKORC1_4451])
-        self.properties[VKORC1_1639] = parse_genotype_VKORC1_1639(record[VKORC1_1639],
-                                                                  self.properties[RACE],
-                                                                  self.properties[VKORC1_2255],
-                                                                  self.properties[VKORC1_1173],
-                                                                  self.properties[VKORC1_1542])
-
+    __slots__ = ("dataset", "index", "properties")
 
+    def __init__(self, dataset, index):
+        """
+        :param dataset: PatientDataset holding the patient data
+        :param index: row of the patient in the data set
+        """
+        self.dataset = dataset
+        self.index = index
+        self.properties = PatientProperties(dataset, index)
@@ -34,33 +34,6 @@ def get_bmi(height, weight):
     return bmi
 
 
-def get_one_hot(enum_value):
-    """
-    Convert enum value into one hot vector
-
-    :param enum_value: input categorical enum value
-    :return: one hot vector for the given enum value
-    """
-    enum_type = type(enum_value)
-    results = [0] * len(enum_type)
-    enum_list = list(enum_type)
-    if enum_value in enum_list:
-        results[enum_list.index(enum_value)] = 1
-    return results
-
-
-def get_one_hot_from_list(enum_value_list):
-    results = []
-    if enum_value_list is not None and len(enum_value_list) > 0:
-        enum_type = type(enum_value_list[0])
-        results = [0] * len(enum_type)
-        enum_list = list(enum_type)
-        for enum_value in enum_value_list:
-            if enum_value in enum_list:
-                results[enum_list.index(enum_value)] = 1
-    return results
-
-
 def parse_dose(d):
     """
     convert dose (string) to na/low/med/high integers
@@ -265,7 +238,7 @@ def parse_genotype_VKORC1_3730(s):
     elif s == "a/g":
         geno = GenoVKORC1_3730.a_g
     elif s == "g/g":
-        geno = GenoVKORC1_1542.g_g
+        geno = GenoVKORC1_3730.g_g
     return geno
 
 
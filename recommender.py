@@ -1,12 +1,19 @@
+import os
 import logging
 import numpy as np
+import concurrent.futures
 from util import *
+from feature_set import *
 
 
 class Recommender(object):
     """
     Abstract Class for implementing a Dose Recommendation Algorithm
     """
+    # whether the state of the model is made of sufficient statistics that can be exported, merged
+    # across models trained on disjoint sets of patients and loaded, see train_parallel
+    supports_merge = False
+
     def __init__(self, config):
         """
         Initialize Recommender Class
@@ -16,6 +23,10 @@ class Recommender(object):
                 logger: logger instance from the logging module
         """
         self.config = config
+        # features used by the model, None if the model does not use patient features
+        self.feature_set = get_feature_set(config.feature_set) if config.feature_set is not None else None
+        # dataset columns read by the model, only these columns are parsed for the selected models
+        self.columns = self.feature_set.columns if self.feature_set is not None else []
 
     def get_reward(self, action, label):
         return CORRECT_DOSE_REWARD if action == label else INCORRECT_DOSE_REWARD
@@ -27,7 +38,7 @@ class Recommender(object):
         :param patient: patient data
         :return: feature vector for the given patient
         """
-        pass
+        return self.feature_set.encode_patient(patient, self.config.sparse_features)
 
     def reset(self):
         """
@@ -47,10 +58,12 @@ class Recommender(object):
         """
         pass
 
-    def recommend(self, patient, eval_results, iter, patient_idx):
+    def recommend(self, features, eval_results, iter, patient_idx):
         """
         Recommend an action.
 
+        :param features: feature vector of the patient (see get_features)
+
         returns:
             action: An integer representing the selected action.
             payoff: A float representing the estimated payoff of the selected action.
@@ -59,7 +72,31 @@ class Recommender(object):
         """
         pass
 
-    def run(self, patients, indices, eval_results, iter, is_training=False):
+    def export_statistics(self):
+        """
+        :return: sufficient statistics of the model, if supports_merge
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support merging statistics")
+
+    def load_statistics(self, statistics):
+        """
+        Replace the state of the model by the given sufficient statistics, if supports_merge
+
+        :param statistics: sufficient statistics, e.g. merged by merge_statistics
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support merging statistics")
+
+    @staticmethod
+    def merge_statistics(statistics):
+        """
+        Merge the sufficient statistics of models trained on disjoint sets of patients, if supports_merge
+
+        :param statistics: list of sufficient statistics (see export_statistics)
+        :return: merged sufficient statistics
+        """
+        raise NotImplementedError("The model does not support merging statistics")
+
+    def run(self, patients, indices, eval_results, iter, is_training=False, features=None):
         """
         Run the model with the provided patient data set.
         When training mode is set to True, the model internal weights are updated.
@@ -68,29 +105,32 @@ class Recommender(object):
         :param patients: complete patient data set
         :param indices: indicies into the patient data set for data points
         :param is_training: whether to run the model in training mode (which updates weights)
+        :param features: optional precomputed feature matrix of the model's feature set for the
+            complete patient data set (see FeatureCache, sparse if config.sparse_features),
+            features are computed per patient otherwise
         :return: lists of regrets and mistakes
         """
         regrets, mistakes = [], []
         actions, payoffs, conf_intervals = [], [], []
         risks = np.zeros((3, 3), dtype=int)  # keep track of decisions made
+        labels = patients.labels
 
         for i in range(len(indices)):
             index = indices[i]
-            patient = patients[index]
-            features = self.get_features(patient)
+            context = features[index] if features is not None else self.get_features(patients[index])
             # skip insufficient records
-            if features is None:
+            if context is None:
                 continue
             # ground truth
-            label = patient.properties[DOSE]
+            label = int(labels[index])
 
-            action, payoff, conf_interval = self.recommend(patient, eval_results, iter, i)
+            action, payoff, conf_interval = self.recommend(context, eval_results, iter, i)
             actions.append(action)
             reward = self.get_reward(action, label)
 
             # only updates the model params in training mode
             if is_training:
-                self.update(action, features, reward)
+                self.update(action, context, reward)
 
             regret = self.get_reward(label, label) - reward
             regrets.append(regret)
@@ -103,3 +143,46 @@ class Recommender(object):
                 conf_intervals.append(conf_interval)
 
         return actions, regrets, mistakes, payoffs, conf_intervals, risks
+
+
+def train_statistics(model_class, config, patients, features=None):
+    """
+    Train a new model on all the given patients, in file order
+
+    :param model_class: subclass of Recommender with supports_merge
+    :param config: config of the model
+    :param patients: PatientDataset
+    :param features: optional precomputed feature matrix of the patients
+    :return: results of the training run (see Recommender.run), sufficient statistics of the model
+    """
+    model = model_class(config)
+    results = model.run(patients, np.arange(len(patients)), None, 0, is_training=True, features=features)
+    return results, model.export_statistics()
+
+
+def train_parallel(model, patients, indices, workers=None, features=None):
+    """
+    Train the model on the given patients in a process pool: the patients are split into one
+    contiguous shard per worker, a new model is trained on every shard, and the merged sufficient
+    statistics are loaded into the model. The shards are trained independently, so the recommended
+    actions differ from a sequential run over all patients.
+
+    :param model: Recommender with supports_merge
+    :param patients: complete patient data set
+    :param indices: indices into the patient data set for data points
+    :param workers: number of worker processes, cpu count if None
+    :param features: optional precomputed feature matrix of the model's feature set for the
+        complete patient data set (see FeatureCache)
+    :return: results of the training runs of the shards, concatenated in the order of indices
+        (see Recommender.run)
+    """
+    if not model.supports_merge:
+        raise ValueError(f"{model.config.algo_name} does not support merging statistics")
+    shards = [shard for shard in np.array_split(np.asarray(indices), workers or os.cpu_count()) if len(shard) > 0]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        outputs = list(executor.map(train_statistics, [type(model)] * len(shards), [model.config] * len(shards),
+                                    [patients.take(shard) for shard in shards],
+                                    [None if features is None else features[shard] for shard in shards]))
+    model.load_statistics(model.merge_statistics([statistics for _, statistics in outputs]))
+    results = [results for results, _ in outputs]
+    return tuple(sum((list(r[i]) for r in results), []) for i in range(5)) + (sum(r[5] for r in results),)
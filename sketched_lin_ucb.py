@@ -0,0 +1,138 @@
+import numpy as np
+import scipy.sparse
+import logging
+from lin_ucb import *
+
+
+class SketchedLinUCBRecommender(Recommender):
+    """
+    Linear UCB with disjoint models, where the design matrix of every arm is approximated by a
+    Frequent Directions sketch Z of rank m (config.sketch_size), as in SOFUL:
+        A ~ Z^T Z + beta * I, beta = lambda + cumulative shrinkage of the sketch
+    By the Woodbury identity, with H = (Z Z^T + beta * I)^-1:
+        A^-1 = (I - Z^T H Z) / beta
+    so that the payoffs and confidence intervals cost O(m * d) per arm and the d x d matrices are
+    never formed.
+
+    The sketch holds up to 2m rows: every update appends the context as a row (H is updated by
+    block inversion in O(m^2)), and when the buffer is full the sketch is shrunk to m - 1 rows
+    by an SVD in O(m^2 * d), i.e. O(m * d) amortized. Memory is O(m * d) per arm.
+    Reference: Kuzborskij, Ilja, Leonardo Cella, and Nicolò Cesa-Bianchi. 2019.
+    “Efficient Linear Bandits through Matrix Sketching.”
+    In Proceedings of the 22nd International Conference on Artificial Intelligence and Statistics,
+    177–85. PMLR.
+    """
+    def __init__(self, config):
+        """
+        Args:
+            alpha: regularization parameter.
+            m: sketch size
+        """
+        super().__init__(config)
+        self.alpha = self.config.alpha
+        self.m = self.config.sketch_size
+        self.d = self.feature_set.dim
+        self.num_arms = len(self.config.actions)
+
+        # Per arm state
+        # sketch buffer, K x 2m x d, rows [0, rows[a]) of arm a are filled
+        self.Z = None
+        self.rows = None
+        # beta = lambda + cumulative shrinkage, K
+        self.beta = None
+        # H = (Z Z^T + beta * I)^-1 of the filled rows, K x 2m x 2m
+        self.H = None
+        # b = D^T * r, K x d, Z * b, K x 2m and H * Z * b, K x 2m
+        self.b = None
+        self.Zb = None
+        self.HZb = None
+        self.reset()
+
+    def reset(self):
+        logging.debug(f"[{self.config.algo_name}] reset!")
+        size = 2 * self.m
+        self.Z = np.zeros((self.num_arms, size, self.d))
+        self.rows = np.zeros(self.num_arms, dtype=int)
+        self.beta = np.full(self.num_arms, float(self.config.ridge))
+        self.H = np.zeros((self.num_arms, size, size))
+        self.b = np.zeros((self.num_arms, self.d))
+        self.Zb = np.zeros((self.num_arms, size))
+        self.HZb = np.zeros((self.num_arms, size))
+
+    def get_projections(self, context_feature):
+        """
+        :param context_feature: feature vector of the patient (dense or sparse CSR row)
+        :return: K x 2m projections Z x of all arms, K values b^T x, x^T x
+        """
+        if scipy.sparse.issparse(context_feature):
+            index, values = context_feature.indices, context_feature.data
+            return np.dot(self.Z[:, :, index], values), np.dot(self.b[:, index], values), np.dot(values, values)
+        return np.dot(self.Z, context_feature), np.dot(self.b, context_feature), \
+            np.dot(context_feature, context_feature)
+
+    def shrink(self, arm):
+        """
+        Frequent Directions shrinkage of the sketch of the arm to its top m - 1 directions
+        """
+        n = self.rows[arm]
+        _, s, Vt = np.linalg.svd(self.Z[arm, :n], full_matrices=False)
+        # squared singular values minus the m-th largest one
+        delta = s[self.m - 1] ** 2 if len(s) >= self.m else 0
+        s2 = np.maximum(s[:self.m - 1] ** 2 - delta, 0)
+        k = len(s2)
+        self.Z[arm] = 0
+        self.Z[arm, :k] = np.sqrt(s2)[:, None] * Vt[:k]
+        self.rows[arm] = k
+        self.beta[arm] += delta
+        # the rows are orthogonal, Z Z^T is diagonal
+        self.H[arm] = 0
+        self.H[arm, range(k), range(k)] = 1 / (s2 + self.beta[arm])
+        self.Zb[arm] = 0
+        self.Zb[arm, :k] = np.dot(self.Z[arm, :k], self.b[arm])
+
+    def update(self, arm, context_feature, reward):
+        logging.debug("[%s] update: action=%s; reward=%s; context=%s", self.config.algo_name, arm, reward,
+                      context_feature)
+        if self.rows[arm] == 2 * self.m:
+            self.shrink(arm)
+        Zx, bx, xx = self.get_projections(context_feature)
+        Zx, bx = Zx[arm], bx[arm]
+        n = self.rows[arm]
+        x = context_feature.toarray()[0] if scipy.sparse.issparse(context_feature) else context_feature
+
+        # append x to the sketch, H by block inversion of [[G, Zx], [Zx^T, x^T x + beta]]
+        H = self.H[arm]
+        H_Zx = np.dot(H[:n, :n], Zx[:n])
+        schur = xx + self.beta[arm] - np.dot(Zx[:n], H_Zx)
+        H[:n, :n] += np.outer(H_Zx, H_Zx / schur)
+        H[:n, n] = H[n, :n] = -H_Zx / schur
+        H[n, n] = 1 / schur
+        self.Z[arm, n] = x
+        self.rows[arm] = n + 1
+
+        # b += r x
+        self.Zb[arm, :n] += reward * Zx[:n]
+        self.Zb[arm, n] = bx + reward * xx
+        self.b[arm] += reward * x
+        self.HZb[arm] = np.dot(H, self.Zb[arm])
+
+    def recommend(self, features, eval_results, iter, patient_idx):
+        if features is None:
+            return None, None, None
+
+        # payoffs and confidence intervals of all arms at once, rows of the sketch not filled are 0
+        Zx, bx, xx = self.get_projections(features)
+        # x^T A^-1 x = (x^T x - x^T Z^T H Z x) / beta, theta^T x = (b^T x - x^T Z^T H Z b) / beta
+        x_invA_x = (xx - np.einsum("ki,kij,kj->k", Zx, self.H, Zx)) / self.beta
+        conf_intervals = self.alpha * np.sqrt(np.maximum(x_invA_x, 0))
+        payoffs = (bx - np.einsum("ki,ki->k", Zx, self.HZb)) / self.beta + conf_intervals
+
+        # ties go to the lowest arm
+        best_arm = int(np.argmax(payoffs))
+        best_payoff = payoffs[best_arm:best_arm + 1]
+        best_conf_interval = conf_intervals[best_arm]
+
+        logging.debug("[%s] recommend: chosen action=%s; estimated payoff=%s; conf interval=%s",
+                      self.config.algo_name, best_arm, best_payoff, best_conf_interval)
+
+        return best_arm, best_payoff, best_conf_interval
@@ -0,0 +1,245 @@
+"""
+Synthetic patient generator for scaling and load tests.
+
+The generator is fitted on a real csv (data/warfarin.csv) and samples patients from the empirical
+joint distribution of the data set with a simple dependency model:
+    - every synthetic patient is assigned a stratum (dose label, race) drawn from the empirical
+      distribution of the strata
+    - the csv columns are split into groups of related columns (demographics, body measures,
+      medical history, medications, INR and dose, genotypes). Each group is copied from a donor
+      patient drawn uniformly from the patients of the same stratum, so the dependencies within
+      a group and the dependencies of every group on the dose label and race are preserved,
+      while the groups are independent given the stratum
+    - known heights and weights are perturbed by multiplicative gaussian noise
+
+Sampling is vectorized (a few numpy calls per batch of patients), and the patients are emitted
+either as csv rows in the schema of the source csv, or as parsed data sets / feature matrices
+without going through csv. Given the seed (and the chunk size of the csv), the output is
+deterministic.
+"""
+import os
+import csv
+import argparse
+import logging
+import numpy as np
+from feature import *
+from ingest import *
+from dataset import *
+
+# first column of every column group, a group spans up to the first column of the next group
+COLUMN_GROUP_STARTS = [GENDER, HEIGHT, INDICATION, MEDICATIONS, TARGET_INR, "Cyp2C9 genotypes"]
+# numerical columns perturbed by multiplicative noise
+NOISY_COLUMNS = [HEIGHT, WEIGHT]
+# prefix of the ids of the synthetic patients
+ID_PREFIX = "SYN"
+
+
+def quote_csv_value(s):
+    if any(c in s for c in ',"\r\n'):
+        return '"' + s.replace('"', '""') + '"'
+    return s
+
+
+def encode_texts(texts):
+    """
+    :param texts: sequence of strings
+    :return: codes (numpy array), numpy object array of the distinct strings
+    """
+    codes, uniques = factorize(texts)
+    return codes, np.array(uniques, dtype=object)
+
+
+class SyntheticPatientGenerator:
+    """
+    Generator of synthetic patients fitted on a real csv, see the module documentation
+    """
+    def __init__(self, header, rows, noise=0.01):
+        """
+        :param header: header of the source csv
+        :param rows: rows of the source csv (lists of raw strings)
+        :param noise: standard deviation of the relative noise of heights and weights
+        """
+        self.header = list(header)
+        self.noise = noise
+        raw_columns = rows_to_raw_columns(header, rows)
+        # the source data set with all records, aligned with the source rows
+        self.columns = parse_columns(raw_columns, keep_missing=True, verbose=False)
+
+        # column groups as ranges of the header
+        starts = [self.header.index(name) for name in COLUMN_GROUP_STARTS] + [len(self.header)]
+        self.id_width = starts[0]
+        self.groups = [self.header[begin:end] for begin, end in zip(starts[:-1], starts[1:])]
+        self.noisy_groups = {name: g for g, group in enumerate(self.groups) for name in group if name in NOISY_COLUMNS}
+
+        # csv text of every group (or of every column of the groups with noisy columns) of the source rows
+        empty = [""] * len(rows)
+        self.texts = []
+        for g, group in enumerate(self.groups):
+            values = [[quote_csv_value(v) for v in raw_columns.get(name, empty)] for name in group]
+            if g in self.noisy_groups.values():
+                self.texts.append([encode_texts(v) for v in values])
+            else:
+                self.texts.append(encode_texts([",".join(v) for v in zip(*values)]))
+
+        # strata: dose label x race, source rows sorted by stratum
+        races = len(Race)
+        labels = self.columns[DOSE].astype(np.int64) - VAL_UNKNOWN
+        strata = labels * races + (self.columns[RACE].astype(np.int64) - min(e.value for e in Race))
+        counts = np.bincount(strata)
+        self.strata = np.flatnonzero(counts)
+        self.stratum_counts = counts[self.strata]
+        self.stratum_probs = self.stratum_counts / self.stratum_counts.sum()
+        self.stratum_starts = np.concatenate([[0], np.cumsum(self.stratum_counts)[:-1]])
+        self.order = np.argsort(strata, kind="stable")
+        logging.info(f"Fitted synthetic patient generator: {len(rows)} source records, "
+                     f"{len(self.strata)} strata, {len(self.groups)} column groups")
+
+    @classmethod
+    def from_csv(cls, filename, noise=0.01):
+        """
+        :param filename: path to the source csv
+        :param noise: standard deviation of the relative noise of heights and weights
+        :return: SyntheticPatientGenerator
+        """
+        with open(filename, newline="") as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            return cls(header, list(reader), noise)
+
+    def sample(self, n, rng):
+        """
+        Sample the donor source rows of n synthetic patients
+
+        :param n: number of patients
+        :param rng: numpy random Generator
+        :return: (n, number of groups) donor rows, (n, len(NOISY_COLUMNS)) relative noise factors
+        """
+        strata = rng.choice(len(self.strata), size=n, p=self.stratum_probs)
+        offsets = (rng.random((n, len(self.groups))) * self.stratum_counts[strata][:, None]).astype(np.int64)
+        donors = self.order[self.stratum_starts[strata][:, None] + offsets]
+        factors = 1 + self.noise * rng.standard_normal((n, len(NOISY_COLUMNS)))
+        return donors, factors
+
+    def get_noisy_values(self, donors, factors):
+        """
+        :param donors: donor rows, see sample
+        :param factors: relative noise factors, see sample
+        :return: dict of noisy column -> (perturbed values, mask of the known values)
+        """
+        results = dict()
+        for i, name in enumerate(NOISY_COLUMNS):
+            values = self.columns[name][donors[:, self.noisy_groups[name]]]
+            known = values > 0
+            results[name] = (np.where(known, np.round(values * factors[:, i], 2), values), known)
+        return results
+
+    def generate_rows(self, n, rng, first_id=0):
+        """
+        Generate the csv rows of n synthetic patients
+
+        :param n: number of patients
+        :param rng: numpy random Generator
+        :param first_id: number of the first patient id
+        :return: list of csv lines (without line breaks)
+        """
+        donors, factors = self.sample(n, rng)
+        noisy_values = self.get_noisy_values(donors, factors)
+        pieces = [[f"{ID_PREFIX}{i}" for i in range(first_id, first_id + n)]] + [[""] * n] * (self.id_width - 1)
+        for g, group in enumerate(self.groups):
+            if g not in self.noisy_groups.values():
+                codes, uniques = self.texts[g]
+                pieces.append(uniques[codes[donors[:, g]]])
+                continue
+            for name, (codes, uniques) in zip(group, self.texts[g]):
+                column = uniques[codes[donors[:, g]]]
+                if name in noisy_values and self.noise != 0:
+                    values, known = noisy_values[name]
+                    column[known] = ["%.2f" % v for v in values[known].tolist()]
+                pieces.append(column)
+        return list(map(",".join, zip(*pieces)))
+
+    def generate_columns(self, n, rng, keep_missing=False):
+        """
+        Generate the column-oriented data set (see ingest.parse_columns) of n synthetic patients,
+        without going through csv
+
+        :param n: number of patients (before filtering out missing data)
+        :param rng: numpy random Generator
+        :param keep_missing: whether to keep records with missing essential data
+        :return: dict of column name -> numpy array
+        """
+        donors, factors = self.sample(n, rng)
+        columns = dict()
+        for g, group in enumerate(self.groups):
+            names = [name for name in group if name in self.columns]
+            names += [name + suffix for name in names for suffix in (OFFSETS, VOCAB) if name + suffix in self.columns]
+            columns.update(take_rows({name: self.columns[name] for name in names}, donors[:, g]))
+        for name, (features, medications) in DERIVED_FLAGS.items():
+            columns[name] = derive_flag_column(columns, features, medications)
+        if self.noise != 0:
+            for name, (values, _) in self.get_noisy_values(donors, factors).items():
+                columns[name] = values
+        return columns if keep_missing else drop_missing(columns)
+
+    def generate_dataset(self, n, rng, keep_missing=False):
+        """
+        :return: PatientDataset of n synthetic patients, see generate_columns
+        """
+        return PatientDataset(self.generate_columns(n, rng, keep_missing))
+
+    def generate_features(self, n, feature_set, rng, keep_missing=False):
+        """
+        Generate the feature matrix and dose labels of n synthetic patients
+
+        :param n: number of patients (before filtering out missing data)
+        :param feature_set: feature_set.FeatureSet
+        :param rng: numpy random Generator
+        :param keep_missing: whether to keep records with missing essential data
+        :return: (number of patients, feature_set.dim) feature matrix, dose labels
+        """
+        dataset = self.generate_dataset(n, rng, keep_missing)
+        return feature_set.encode(dataset), dataset.labels
+
+    def write_csv(self, filename, n, rng, first_id=0, chunk_size=100000):
+        """
+        Write n synthetic patients into a csv with the schema of the source csv
+
+        :param filename: path to the csv
+        :param n: number of patients
+        :param rng: numpy random Generator
+        :param first_id: number of the first patient id
+        :param chunk_size: number of patients generated at once
+        """
+        with open(filename, "w", newline="") as f:
+            f.write(",".join(quote_csv_value(name) for name in self.header) + "\n")
+            for start in range(0, n, chunk_size):
+                rows = self.generate_rows(min(chunk_size, n - start), rng, first_id + start)
+                f.write("\n".join(rows) + "\n")
+        logging.info(f"Wrote {n} synthetic patients: {filename}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", required=True, type=int, help="number of synthetic patients")
+    parser.add_argument("--out", required=True, type=str,
+                        help="output csv, or output directory of the csv shards with --shards")
+    parser.add_argument("--source", required=False, type=str, default="data/warfarin.csv",
+                        help="csv the generator is fitted on")
+    parser.add_argument("--seed", required=False, type=int, default=0)
+    parser.add_argument("--shards", required=False, type=int, help="number of csv shards to write")
+    parser.add_argument("--noise", required=False, type=float, default=0.01,
+                        help="standard deviation of the relative noise of heights and weights")
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s:%(levelname)s: %(message)s', level=logging.INFO)
+
+    generator = SyntheticPatientGenerator.from_csv(args.source, args.noise)
+    if args.shards is None:
+        generator.write_csv(args.out, args.rows, np.random.default_rng(args.seed))
+    else:
+        # independent random streams per shard, so shards can be regenerated separately
+        os.makedirs(args.out, exist_ok=True)
+        seeds = np.random.SeedSequence(args.seed).spawn(args.shards)
+        bounds = np.linspace(0, args.rows, args.shards + 1).astype(np.int64)
+        for i in range(args.shards):
+            generator.write_csv(os.path.join(args.out, f"part-{i:05d}.csv"), int(bounds[i + 1] - bounds[i]),
+                                np.random.default_rng(seeds[i]), first_id=int(bounds[i]))
@@ -0,0 +1,41 @@
+"""
+Checks of the binary cache of the parsed data set: the cached columns equal the parsed ones.
+"""
+import os
+import shutil
+import numpy as np
+from cache import *
+
+
+def assert_columns_equal(columns, expected):
+    assert list(columns) == list(expected)
+    for name in expected:
+        assert columns[name].dtype == expected[name].dtype, name
+        assert np.array_equal(columns[name], expected[name], equal_nan=columns[name].dtype.kind == "f"), name
+
+
+def test_load_columns_cache_round_trip(tmp_path, monkeypatch):
+    # CACHE_DIR is relative to the working directory
+    shutil.copy("data/warfarin.csv", tmp_path / "warfarin.csv")
+    monkeypatch.chdir(tmp_path)
+    parsed, raw_count = load_columns("warfarin.csv", use_cache=False)
+    assert not os.path.exists(CACHE_DIR)
+
+    # parsed and saved, then loaded from the cache
+    for i in range(2):
+        columns, count = load_columns("warfarin.csv")
+        assert count == raw_count
+        assert_columns_equal(columns, parsed)
+    assert os.listdir(CACHE_DIR) == [os.path.basename(get_cache_filename("warfarin.csv", False))]
+
+    # a projection is served from the cache of all columns
+    selected = [AGE, MEDICATIONS]
+    columns, count = load_columns("warfarin.csv", selected=selected)
+    assert count == raw_count
+    assert_columns_equal(columns, load_columns("warfarin.csv", use_cache=False, selected=selected)[0])
+    assert len(os.listdir(CACHE_DIR)) == 1
+
+    # keep_missing is part of the key
+    columns, count = load_columns("warfarin.csv", keep_missing=True)
+    assert_columns_equal(columns, load_columns("warfarin.csv", keep_missing=True, use_cache=False)[0])
+    assert len(os.listdir(CACHE_DIR)) == 2
@@ -0,0 +1,74 @@
+"""
+Checks of the batched feature encoders against the per-patient features of the recommenders, computed
+from the decoded properties of every patient with the preprocess helpers.
+"""
+import numpy as np
+import scipy.sparse
+from warfarin import *
+
+patients = load_data("data/warfarin.csv")
+# every 10th patient, the per-patient features decode every property of the patient
+rows = np.arange(0, len(patients), 10)
+
+
+def get_one_hot(enum_type, enum_values):
+    """
+    :return: multi-hot vector of the given enum values, in the order of the members of the enum type
+    """
+    members = list(enum_type)
+    return [1 if e in enum_values else 0 for e in members]
+
+
+def get_full_features(patient):
+    """
+    :return: features full134 of the patient, as computed per patient by the linear bandits
+    """
+    properties = patient.properties
+    features = [1, properties[AGE].value,
+                feature_scaling(BMI_MIN, BMI_MAX, get_bmi(properties[HEIGHT], properties[WEIGHT])),
+                feature_scaling(INR_MIN, INR_MAX, properties[INR]),
+                feature_scaling(INR_MIN, INR_MAX, properties[TARGET_INR])]
+    features += get_one_hot(Indication, properties[INDICATION])
+    features += get_one_hot(Gender, [properties[GENDER]])
+    features += get_one_hot(Race, [properties[RACE]])
+    for f in BINARY_FEATURES:
+        features += get_one_hot(BinaryFeature, [properties[f]])
+    features += get_one_hot(GenoCYP2C9, properties[CYP2C9])
+    for f in VKORC1_GENO_FEATURES:
+        features += get_one_hot(PROPERTY_ENUMS[f], [properties[f]])
+    return np.array(features, dtype=float)
+
+
+def get_clinical_features(patient):
+    """
+    :return: features clinical of the patient, as computed per patient by the clinical dosing algorithm
+    """
+    properties = patient.properties
+    enzyme = properties[TEGRETOL] is BinaryFeature.true or properties[DILANTIN] is BinaryFeature.true or \
+        properties[RIFAMPIN] is BinaryFeature.true or \
+        any(m in properties[MEDICATIONS] for m in ["carbamazepine", "phenytoin", "rifampin", "rifampicin"])
+    amiodarone = properties[CORDARONE] is BinaryFeature.true or "amiodarone" in properties[MEDICATIONS]
+    return np.array([1, properties[AGE].value, properties[HEIGHT], properties[WEIGHT],
+                     properties[RACE] is Race.asian, properties[RACE] is Race.black,
+                     properties[RACE] is Race.unknown, enzyme, amiodarone], dtype=float)
+
+
+def test_encode_matches_per_patient_features():
+    for name, get_features in [("full134", get_full_features), ("clinical", get_clinical_features)]:
+        feature_set = get_feature_set(name)
+        expected = np.array([get_features(patients[i]) for i in rows])
+        assert feature_set.dim == expected.shape[1]
+        np.testing.assert_array_equal(feature_set.encode(patients, rows), expected)
+        np.testing.assert_array_equal(feature_set.encode_patient(patients[rows[1]]), expected[1])
+
+
+def test_encode_sparse_matches_encode():
+    for name in FEATURE_SETS:
+        feature_set = get_feature_set(name)
+        matrix = feature_set.encode_sparse(patients, rows)
+        assert scipy.sparse.isspmatrix_csr(matrix) and matrix.shape == (len(rows), feature_set.dim)
+        # no explicit zeros
+        assert np.all(matrix.data != 0)
+        np.testing.assert_array_equal(matrix.toarray(), feature_set.encode(patients, rows))
+        np.testing.assert_array_equal(feature_set.encode_patient(patients[rows[1]], sparse=True).toarray(),
+                                      matrix[1].toarray())
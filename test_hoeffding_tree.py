@@ -0,0 +1,80 @@
+"""
+Checks of the incremental decision tree: the grown tree does not depend on the order of the feature
+columns, and the split statistics of all features of a node cover the same samples.
+"""
+import numpy as np
+from hoeffding_tree import *
+
+
+def get_structure(node, columns):
+    """
+    :param columns: original column of every feature
+    :return: nested (feature, threshold, left, right) tuples of the splits, in the original columns
+    """
+    if node.feature is None:
+        return None
+    return (int(columns[node.feature]), float(node.threshold), get_structure(node.left, columns),
+            get_structure(node.right, columns))
+
+
+def get_nodes(node):
+    return [node] if node.feature is None else [node] + get_nodes(node.left) + get_nodes(node.right)
+
+
+def grow_tree(X, y):
+    tree = HoeffdingTree(max_depth=4, min_samples_split=37, min_samples_leaf=11, split_confidence=0.05)
+    for x, label in zip(X, y):
+        tree.learn(x, label)
+    return tree
+
+
+def get_data(seed=0, n=5000, d=4):
+    # the label is x0 > 0.5 with 20% label noise, the other features are uniform noise
+    rng = np.random.default_rng(seed)
+    X = rng.random((n, d))
+    return X, ((X[:, 0] > 0.5) ^ (rng.random(n) < 0.2)).astype(int)
+
+
+def test_structure_does_not_depend_on_column_order():
+    X, y = get_data()
+    d = X.shape[1]
+    reference = get_structure(grow_tree(X, y).root, np.arange(d))
+    assert reference[0] == 0
+    for columns in [[2, 1, 0, 3], [3, 2, 1, 0], [1, 3, 0, 2]]:
+        columns = np.array(columns)
+        assert get_structure(grow_tree(X[:, columns], y).root, columns) == reference
+
+
+def test_split_statistics_are_consistent():
+    X, y = get_data(seed=1, d=6)
+    tree = grow_tree(X, y)
+    nodes = get_nodes(tree.root)
+    assert len(nodes) > 1
+    for node in nodes:
+        # every feature's histogram holds the node.n samples seen by the node since it was created
+        assert np.all(node.histogram.sum(axis=(1, 2)) == node.n)
+    assert tree.num_leaves == sum(node.feature is None for node in nodes)
+
+
+def get_leaves(node, start):
+    """
+    :return: list of (leaf, start of its parent)
+    """
+    if node.feature is None:
+        return [(node, start)]
+    return get_leaves(node.left, node.start) + get_leaves(node.right, node.start)
+
+
+def test_leaf_counts_are_the_counts_of_their_samples():
+    # the label depends on x0 and x1, so that the tree grows below its first split
+    rng = np.random.default_rng(2)
+    X = rng.random((5000, 6))
+    y = (((X[:, 0] > 0.5) & (X[:, 1] > 0.3)) ^ (rng.random(5000) < 0.1)).astype(int)
+    tree = grow_tree(X, y)
+    leaves = get_leaves(tree.root, 0)
+    assert len(leaves) > 2
+    routed = np.array([id(tree.get_leaf(x)) for x in X])
+    for leaf, start in leaves:
+        # a leaf holds the samples of its region since its parent was created
+        labels = y[start:][routed[start:] == id(leaf)]
+        assert leaf.counts.tolist() == [np.sum(labels == 0), np.sum(labels == 1)]
@@ -0,0 +1,75 @@
+"""
+Checks of the Gram coordinate descent of LassoBandit against refits of sklearn.linear_model.Lasso on
+the samples of every arm.
+"""
+import numpy as np
+from sklearn.linear_model import Lasso
+from warfarin import *
+
+
+class RecordingLassoBandit(LassoBandit):
+    """
+    LassoBandit keeping the samples of every arm
+    """
+    def reset(self):
+        super().reset()
+        # (forced, arm) -> lists of the features and rewards of the samples
+        self.samples = {(forced, a): ([], []) for forced in [True, False] for a in range(self.num_arms)}
+
+    def update(self, arm, context_feature, reward):
+        for forced in [True, False] if self.forced else [False]:
+            X, y = self.samples[(forced, arm)]
+            X.append(context_feature)
+            y.append(reward)
+        super().update(arm, context_feature, reward)
+
+
+class SklearnLassoBandit(RecordingLassoBandit):
+    """
+    LassoBandit whose estimators are refitted by sklearn on the samples of the arm after every update
+    """
+    def update(self, arm, context_feature, reward):
+        forced = self.forced
+        super().update(arm, context_feature, reward)
+        for is_forced, lam, coef, intercept in [(True, self.lambda1, self.force_coef, self.force_intercept),
+                                                (False, self.lambda2, self.all_coef, self.all_intercept)]:
+            if is_forced and not forced:
+                continue
+            estimator = Lasso(alpha=lam).fit(*self.samples[(is_forced, arm)])
+            coef[arm], intercept[arm] = estimator.coef_, estimator.intercept_
+
+
+def train(model_class, num_patients, warm_start=False, seed=1):
+    patients = load_data("data/warfarin.csv")
+    config = get_config("lasso", "results/")
+    config.warm_start = warm_start
+    model = model_class(config)
+    features = FeatureCache(patients).get(model.feature_set, False)
+    indices = np.random.RandomState(seed).permutation(len(patients))[:num_patients]
+    actions = model.run(patients, indices, None, 0, is_training=True, features=features)[0]
+    return model, actions, features[np.random.RandomState(seed + 1).permutation(len(patients))[:200]]
+
+
+def test_actions_match_sklearn_refits():
+    # the first action differing from sklearn with warm starts is at t=84 on this permutation
+    model, actions, new_features = train(LassoBandit, 300)
+    reference, reference_actions, _ = train(SklearnLassoBandit, 300)
+    assert actions == reference_actions
+    for predictions, reference_predictions in zip(model.predict(new_features), reference.predict(new_features)):
+        assert np.max(np.abs(predictions - reference_predictions)) < 1e-6
+
+
+def test_refits_match_sklearn_objective():
+    # with warm starts the minimizer may differ from sklearn's, the objective values must not
+    model, _, _ = train(RecordingLassoBandit, 1500, warm_start=True)
+    for arm in range(model.num_arms):
+        X, y = map(np.array, model.samples[(False, arm)])
+        statistics = model.all_statistics[arm]
+        if len(y) < 2:
+            continue
+        lam = statistics.lam_
+        fit = Lasso(alpha=lam, tol=1e-10, max_iter=100000).fit(X, y)
+        objective = 0.5 * np.mean((y - fit.predict(X)) ** 2) + lam * np.sum(np.abs(fit.coef_))
+        # the objective is minimized up to the tolerance of the duality gap (tol * var(y))
+        assert statistics.get_objective(lam) <= objective + statistics.tol * np.var(y) + 1e-9
+        assert np.max(np.abs(X @ statistics.coef_ + statistics.intercept_ - fit.predict(X))) < 2e-3
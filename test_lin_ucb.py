@@ -0,0 +1,81 @@
+"""
+Checks of the LinUCB recommenders against reference runs: sparse against dense features, replicas against
+sequential runs, merged sufficient statistics against a single model.
+"""
+import numpy as np
+from warfarin import *
+
+patients = load_data("data/warfarin.csv")
+
+
+def run_training(algo, indices, sparse=False):
+    """
+    :return: model trained on the patients of indices, results of Recommender.run
+    """
+    config = get_config(algo, "results/")
+    config.sparse_features = sparse
+    model = get_recommender(algo, "results/", config)
+    features = FeatureCache(patients).get(model.feature_set, sparse)
+    return model, model.run(patients, indices, None, 0, is_training=True, features=features)
+
+
+def test_hybrid_sparse_features():
+    indices = np.random.RandomState(0).permutation(len(patients))[:500]
+    dense_model, dense = run_training("linucb_hybrid", indices)
+    sparse_model, sparse = run_training("linucb_hybrid", indices, sparse=True)
+    assert sparse[0] == dense[0]
+    assert np.allclose(sparse_model.beta, dense_model.beta)
+
+
+def test_replicas_match_sequential_runs():
+    rng = np.random.RandomState(1)
+    splits = [rng.permutation(len(patients))[:600] for r in range(3)]
+    training, testing = np.array([s[:400] for s in splits]), np.array([s[400:] for s in splits])
+    alphas = [0.5, 1.0, 2.0]
+    model = get_recommender("linucb_disjoint", "results/", get_config("linucb_disjoint", "results/"))
+    features = FeatureCache(patients).get(model.feature_set)
+    model.reset_replicas(len(alphas), alphas)
+    replica_training = model.run_replicas(patients, training, is_training=True, features=features)
+    replica_testing = model.run_replicas(patients, testing, features=features)
+    for r, alpha in enumerate(alphas):
+        model.alpha = alpha
+        model.reset()
+        for indices, is_training, replica in [(training[r], True, replica_training[r]),
+                                              (testing[r], False, replica_testing[r])]:
+            results = model.run(patients, indices, None, 0, is_training=is_training, features=features)
+            # actions, regrets and mistakes
+            for i in range(3):
+                assert replica[i] == results[i]
+            assert np.allclose(np.concatenate(replica[3]), np.concatenate(results[3]))
+            assert np.allclose(replica[4], results[4])
+            assert np.array_equal(replica[5], results[5])
+        assert np.allclose(model.theta, model.replica_theta[r])
+
+
+def test_merged_statistics_match_single_pass(tmp_path):
+    indices = np.random.RandomState(2).permutation(len(patients))[:900]
+    shards = np.array_split(indices, 3)
+    for algo in ["lints", "linucb_disjoint"]:
+        statistics = []
+        # single model updated with the recommendations of the models of all shards, in order
+        model = get_recommender(algo, "results/", get_config(algo, "results/"))
+        features = FeatureCache(patients).get(model.feature_set)
+        for shard in shards:
+            shard_model, results = run_training(algo, shard)
+            statistics.append(shard_model.export_statistics())
+            for index, action in zip(shard, results[0]):
+                model.update(action, features[index], model.get_reward(action, patients.labels[index]))
+        save_statistics(tmp_path / "merged.npz", merge_statistics(statistics))
+        merged = get_recommender(algo, "results/", get_config(algo, "results/"))
+        merged.load_statistics(read_statistics(tmp_path / "merged.npz"))
+        assert np.array_equal(merged.counts, model.counts)
+        assert np.allclose(merged.A, model.A)
+        assert np.allclose(merged.b, model.b)
+        assert np.allclose(merged.theta, model.theta)
+
+    # the same shards of linucb_disjoint (deterministic) trained in a process pool
+    parallel = get_recommender("linucb_disjoint", "results/", get_config("linucb_disjoint", "results/"))
+    results = train_parallel(parallel, patients, indices, workers=3)
+    assert len(results[0]) == len(indices) and results[5].sum() == len(indices)
+    assert np.allclose(parallel.A, merged.A)
+    assert np.allclose(parallel.theta, merged.theta)
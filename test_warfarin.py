@@ -0,0 +1,48 @@
+"""
+Checks of the loading of the data set from csv shards against the loading of the single csv.
+"""
+import csv
+import numpy as np
+from warfarin import *
+
+
+def write_shards(path, sizes):
+    """
+    Split data/warfarin.csv into csv shards of the given numbers of rows (the rest in the last shard)
+    """
+    with open("data/warfarin.csv", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        rows = list(reader)
+    starts = np.cumsum([0] + sizes)
+    for i, (start, end) in enumerate(zip(starts, list(starts[1:]) + [len(rows)])):
+        with open(path / f"shard{i}.csv", "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(rows[start:end])
+
+
+def assert_datasets_equal(dataset, expected):
+    assert dataset.property_names == expected.property_names
+    for name in expected.columns:
+        assert np.array_equal(dataset.columns[name], expected.columns[name], equal_nan=True), name
+    for name, (values, offsets) in expected.lists.items():
+        assert np.array_equal(dataset.lists[name][1], offsets), name
+        if name == MEDICATIONS:
+            # the ids are remapped into the merged vocabulary
+            assert [dataset.medication_vocab[v] for v in dataset.lists[name][0]] == \
+                   [expected.medication_vocab[v] for v in values]
+        else:
+            assert np.array_equal(dataset.lists[name][0], values), name
+
+
+def test_shards_match_single_csv(tmp_path):
+    expected = load_data("data/warfarin.csv", use_cache=False)
+    # shards of unequal sizes, with different medication vocabularies
+    write_shards(tmp_path, [1500, 2, 2500])
+    assert_datasets_equal(load_data(str(tmp_path), use_cache=False, workers=2), expected)
+    assert_datasets_equal(load_data(str(tmp_path / "shard*.csv"), use_cache=False, workers=2), expected)
+
+    selected = get_required_columns([get_recommender("lasso", "results/")])
+    assert_datasets_equal(load_data(str(tmp_path), use_cache=False, workers=2, selected=selected),
+                          load_data("data/warfarin.csv", use_cache=False, selected=selected))
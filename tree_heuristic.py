@@ -1,6 +1,7 @@
 from recommender import *
 from preprocess import *
 from sklearn import tree
+from hoeffding_tree import *
 from plot_utils import *
 import math
 import logging
@@ -13,75 +14,19 @@ LABEL_FAILED = 1
 #  A Practical Method for Solving Contextual Bandit Problems Using Decision Trees:
 #       https://arxiv.org/pdf/1706.04687.pdf
 #
-# For further improvements (of performance issue):
+# For further improvements (of performance issue), used by the incremental trees (see hoeffding_tree.py):
 #  Extremely Fast Decision Tree:
 #       https://arxiv.org/pdf/1802.08780.pdf
 #
 class TreeHeuristicRecommender(Recommender):
 
-    def get_clinical_meds(self, patient):
-        enzyme = 1 if patient.properties[TEGRETOL] is BinaryFeature.true or \
-                      patient.properties[DILANTIN] is BinaryFeature.true or \
-                      patient.properties[RIFAMPIN] is BinaryFeature.true or \
-                      any(m in patient.properties[MEDICATIONS] for m in ["carbamazepine", "phenytoin", "rifampin",
-                                                                         "rifampicin"]) \
-            else 0
-
-        amiodarone = 1 if patient.properties[CORDARONE] is BinaryFeature.true or \
-                          "amiodarone" in patient.properties[MEDICATIONS] \
-            else 0
-        return [enzyme, amiodarone]
-
-    def load_basic_features(self, patient):
-        features = [patient.properties[AGE].value, patient.properties[HEIGHT], patient.properties[WEIGHT],
-                    1 if patient.properties[RACE] is Race.asian else 0,
-                    1 if patient.properties[RACE] is Race.black else 0,
-                    1 if patient.properties[RACE] is Race.unknown else 0] + self.get_clinical_meds(patient)
-
-        return features
-
-    def get_clinical_features(self, patient):
-        """
-        Same features as for clinical dose algorithm (a.k.a. basic)
-        """
-        if self.feature_names is None:
-            self.init__basic_feature_names()
-
-        return np.array(self.load_basic_features(patient))
-
-    def init__basic_feature_names(self):
-        self.feature_names = [AGE, HEIGHT, WEIGHT, "Asian", "African", "Other", "Enzyme", "Amiodarone"]
-
-    def get_extended_features(self, patient):
-        """
-        Extended set of features
-        """
-        f = list([patient.properties[AGE].value]) + self.get_clinical_meds(patient) # size: 3
-
-        f.append(feature_scaling(BMI_MIN, BMI_MAX,
-                                 get_bmi(patient.properties[HEIGHT], patient.properties[WEIGHT])))  # size: 1
-
-        f += get_one_hot(patient.properties[GENDER])    # size: 3
-        f += get_one_hot(patient.properties[VKORC1_1639])   # size: 4
-        f += get_one_hot(patient.properties[ASPIRIN])   # size: 3
-        f += get_one_hot(patient.properties[SMOKER])    # size: 3
-        f += get_one_hot(patient.properties[IS_STABLE]) # size: 3
-
-        return np.array(f)
-
-    def get_features(self, patient):
-        f = self.config.feature_set
-        if f == "clinical":
-            return self.get_clinical_features(patient)
-        return self.get_extended_features(patient)
-
     def __init__(self, config):
         super().__init__(config)
 
         self.num_arms = self.config.num_arms
         self.action_trees = []
 
-        self.feature_names = None
+        self.feature_names = self.feature_set.names
 
         self.S_0 = []           # default success count (usually 1 for each arm)
         self.F_0 = []           # default failure count (usually 1 for each arm)
@@ -112,13 +57,22 @@ class TreeHeuristicRecommender(Recommender):
 
         # Decision Tree for each action. At each node we keep number of
         # successes and failures (so our label is binary)
-        self.action_trees = [None for _ in range(self.num_arms)]
+        self.action_trees = [self._get_incremental_tree() if self.config.incremental else None
+                             for _ in range(self.num_arms)]
 
         self.iter += 1
         self.iter_item_id = 0
         self.num_correct = 0
 
 
+    def _get_incremental_tree(self):
+        return HoeffdingTree(criterion=self.config.criterion, max_depth=self.config.tree_depth,
+                             min_samples_split=self.config.min_samples_split,
+                             min_samples_leaf=self.config.min_samples_leaf,
+                             max_leaf_nodes=self.config.max_leaf_nodes,
+                             split_confidence=self.config.split_confidence,
+                             grace_period=self.config.grace_period, num_bins=self.config.num_bins)
+
     def estimate_arm(self, params, arm):
         """
         Sample beta distrubution. params is (F, S) for
@@ -140,6 +94,10 @@ class TreeHeuristicRecommender(Recommender):
         if theta_tree is None:
             return 0, 0
 
+        if self.config.incremental:
+            counts = theta_tree.get_counts(x_t)
+            return int(counts[LABEL_FAILED]), int(counts[LABEL_SUCCESS])
+
         #
         # The following code looks quite hacky, but we could not find more elegant way
         # to extract number of successes and failures from node for the context out of
@@ -156,8 +114,8 @@ class TreeHeuristicRecommender(Recommender):
         F = result[class_ids[LABEL_FAILED]] if LABEL_FAILED in class_ids else 0
         return F, S
 
-    def recommend(self, patient, eval_results, iter, patient_idx):
-        x_t = self.get_features(patient)
+    def recommend(self, features, eval_results, iter, patient_idx):
+        x_t = features
         # distrubutions for arms
         p_a = [self.query_distribution(a, x_t) for a in range(self.num_arms)]
         # choose argmax arm
@@ -188,9 +146,14 @@ class TreeHeuristicRecommender(Recommender):
 
     def update(self, arm, x_t, reward):
         label = LABEL_SUCCESS if reward == CORRECT_DOSE_REWARD else LABEL_FAILED
-        self.Dta_x[arm].append(x_t)
-        self.Dta_y[arm].append(label)
-        self._update_tree(arm)
+        if self.config.incremental:
+            # O(depth * d) update of the counts and split statistics of the path of the sample
+            self.action_trees[arm].learn(x_t, label)
+            self.Nt[arm] += 1
+        else:
+            self.Dta_x[arm].append(x_t)
+            self.Dta_y[arm].append(label)
+            self._update_tree(arm)
 
         #
         # the following should ideally be moved to executor
@@ -217,6 +180,10 @@ class TreeHeuristicRecommender(Recommender):
 
         if not self.feature_names is None:
             for a in range(self.num_arms):
+                if self.config.incremental:
+                    self.action_trees[a].export_graphviz(
+                        self.config.output_path + "tree_arm_" + str(a) + ".dot", self.feature_names)
+                    continue
                 tree.export_graphviz(self.action_trees[a],
                     filled=True,
                     out_file=self.config.output_path + "tree_arm_" + str(a) + ".dot",
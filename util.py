@@ -1,5 +1,6 @@
 import sys
 import csv
+import numpy as np
 import matplotlib
 matplotlib.use('agg')
 import matplotlib.pyplot as plt
@@ -48,6 +49,36 @@ def get_int(s):
     return value
 
 
+def make_csr(lists, dtype):
+    """
+    Pack a list of lists into flat values and offsets (CSR layout)
+
+    :param lists: list of lists
+    :param dtype: numpy dtype of the values
+    :return: values, offsets
+    """
+    offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(l) for l in lists])
+    values = np.array([v for l in lists for v in l], dtype=dtype)
+    return values, offsets
+
+
+def take_csr(values, offsets, rows):
+    """
+    Select rows of a CSR packed column
+
+    :param values: flat values
+    :param offsets: offsets into values, one per row plus the end
+    :param rows: indices of the rows to select
+    :return: values, offsets of the selected rows
+    """
+    lengths = (offsets[1:] - offsets[:-1])[rows]
+    new_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    new_offsets[1:] = np.cumsum(lengths)
+    index = np.arange(new_offsets[-1]) + np.repeat(offsets[:-1][rows] - new_offsets[:-1], lengths)
+    return values[index], new_offsets
+
+
 def export_stats_list(stats_list, filename):
     """
     Export a stats list to a file
@@ -1,16 +1,21 @@
 import csv
 import os
+import glob
 import argparse
+import concurrent.futures
 import evaluation
 import logging
 from config import *
 from fixed_dose import *
 from clinical_dose import *
 from lin_ucb import *
+from lin_ts import *
+from sketched_lin_ucb import *
 from tree_heuristic import *
-from patient import *
+from dataset import *
 from lasso_bandit import *
 from ensemble_majority3 import *
+from cache import *
 
 
 parser = argparse.ArgumentParser()
@@ -18,55 +23,126 @@ parser.add_argument("--algo", required=True, type=str,
                     choices=ALGOS + ["all"])
 parser.add_argument("--iter", required=False, type=int)
 parser.add_argument("--train_ratio", required=False, type=float)
-
-
-def get_recommender(algo, output_path):
+parser.add_argument("--no_cache", action="store_true",
+                    help="parse the csv even if the parsed data set cache exists")
+parser.add_argument("--data", required=False, type=str, default="data/warfarin.csv",
+                    help="path to the patient data csv, or a directory / glob pattern of csv shards")
+parser.add_argument("--workers", required=False, type=int,
+                    help="number of processes for parsing csv shards, default is the cpu count")
+parser.add_argument("--stream", action="store_true",
+                    help="stream the csv in batches and run online evaluation only, with bounded memory")
+parser.add_argument("--batch_size", required=False, type=int, default=10000,
+                    help="number of csv rows per batch in --stream mode")
+parser.add_argument("--replicas", action="store_true",
+                    help="run the iterations of the LinUCB models as replicas in lockstep")
+parser.add_argument("--train_workers", required=False, type=int,
+                    help="number of processes training the linear models on shards of the training set")
+
+
+def get_recommender(algo, output_path, config=None):
+    config = get_config(algo, output_path) if config is None else config
 
     # default recommender: FixedDose
-    model = FixedDoseRecommender(get_config(algo, output_path))
+    model = FixedDoseRecommender(config)
 
     if algo == "clinical_dose":
-        model = ClinicalDoseRecommender(get_config(algo, output_path))
+        model = ClinicalDoseRecommender(config)
     elif algo == "linucb_disjoint":
-        model = LinUCBDisjointRecommender(get_config(algo, output_path))
+        model = LinUCBDisjointRecommender(config)
     elif algo == "linucb_disjoint_basic":
-        model = LinUCBDisjointBasicRecommender(get_config(algo, output_path))
+        model = LinUCBDisjointBasicRecommender(config)
+    elif algo == "linucb_sketch":
+        model = SketchedLinUCBRecommender(config)
+    elif algo == "lints":
+        model = LinTSRecommender(config)
+    elif algo == "linucb_hybrid":
+        model = LinUCBHybridRecommender(config)
     elif algo.startswith("tree"):
-        model = TreeHeuristicRecommender(get_config(algo, output_path))
+        model = TreeHeuristicRecommender(config)
     elif algo == "lasso":
-        model = LassoBandit(get_config(algo, output_path))
+        model = LassoBandit(config)
     elif algo == "majority3":
-        model = Majority3Recommender(get_config(algo, output_path))
+        model = Majority3Recommender(config)
     return model
 
 
-def parse_all_records(records, keep_missing=False):
+def get_required_columns(models):
     """
-    Parse data rows loaded from csv into list of Patient
+    :param models: list of recommender models
+    :return: union of the dataset columns read by the models
+    """
+    return list(dict.fromkeys(c for model in models for c in model.columns))
+
 
-    :param records: DictReader of the csv
-    :return: list of Patient
+def get_data_filenames(path):
     """
-    results = list()
-    rawCount = 0
-    for r in records:
-        rawCount += 1
-        patient = Patient(r)
-        # filter out records with missing essential data
-        if keep_missing or not (patient.properties[AGE] is AgeGroup.unknown or
-                                patient.properties[HEIGHT] == VAL_UNKNOWN or
-                                patient.properties[WEIGHT] == VAL_UNKNOWN or
-                                patient.properties[DOSE] == VAL_UNKNOWN):
-            results.append(patient)
-    logging.info(f"Parsing raw records: loaded record count={rawCount}, returned patient count={len(results)}, "
-                 f"keep_missing={keep_missing}")
-    return results
-
-
-def load_data(filename):
-    logging.info(f"Loading data set from: {filename}")
-    raw_data = csv.DictReader(open(filename))
-    return parse_all_records(raw_data, keep_missing=False)
+    Resolve the data path into the list of csv files
+
+    :param path: csv file, directory of csv shards or glob pattern of csv shards
+    :return: sorted list of csv files
+    """
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, "*.csv")))
+    if glob.has_magic(path):
+        return sorted(glob.glob(path))
+    return [path]
+
+
+def load_data(path, keep_missing=False, use_cache=True, workers=None, selected=None):
+    """
+    Load patient data set from a csv or from a set of csv shards. Shards are parsed
+    concurrently in a process pool and merged in the sorted order of their file names.
+    The parsed data set of each csv is cached in CACHE_DIR, so that subsequent runs with
+    the same csv skip parsing.
+
+    :param path: csv file, directory of csv shards or glob pattern of csv shards
+    :param keep_missing: whether to keep records with missing essential data
+    :param use_cache: whether to load / store the parsed data set from / to the cache
+    :param workers: number of worker processes for parsing shards, cpu count if None
+    :param selected: columns to parse (see ingest.get_parsed_columns), all columns if None
+    :return: PatientDataset
+    """
+    logging.info(f"Loading data set from: {path}, parsed columns: {len(get_parsed_columns(selected))} "
+                 f"of {len(ALL_COLUMNS)}")
+    filenames = get_data_filenames(path)
+    if len(filenames) == 0:
+        raise ValueError(f"No csv files found: {path}")
+
+    if len(filenames) == 1:
+        results = [load_columns(filenames[0], keep_missing, use_cache, selected)]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(load_columns, filenames, [keep_missing] * len(filenames),
+                                        [use_cache] * len(filenames), [selected] * len(filenames)))
+
+    for filename, (columns, raw_count) in zip(filenames, results):
+        logging.info(f"Parsing raw records: file={filename}, loaded record count={raw_count}, "
+                     f"returned patient count={get_row_count(columns)}, keep_missing={keep_missing}")
+
+    columns = results[0][0] if len(results) == 1 else concat_columns([c for c, _ in results])
+    if len(results) > 1:
+        logging.info(f"Merged {len(results)} shards: loaded record count={sum(r for _, r in results)}, "
+                     f"returned patient count={get_row_count(columns)}")
+    return PatientDataset(columns)
+
+
+def stream_data(path, batch_size, keep_missing=False, selected=None):
+    """
+    Stream patient data set from a csv or from a set of csv shards (in the sorted order of
+    their file names) in batches, holding only one batch in memory
+
+    :param path: csv file, directory of csv shards or glob pattern of csv shards
+    :param batch_size: number of csv rows per batch
+    :param keep_missing: whether to keep records with missing essential data
+    :param selected: columns to parse (see ingest.get_parsed_columns), all columns if None
+    :return: generator of PatientDataset
+    """
+    for filename in get_data_filenames(path):
+        logging.info(f"Streaming data set from: {filename}, batch_size={batch_size}")
+        with open(filename, newline="") as f:
+            for columns in parse_column_batches(f, batch_size, keep_missing=keep_missing, selected=selected):
+                if get_row_count(columns) > 0:
+                    yield PatientDataset(columns)
 
 
 if __name__ == '__main__':
@@ -78,8 +154,7 @@ if __name__ == '__main__':
         os.makedirs(output_path)
     log_path = output_path + "log.txt"
     logging.basicConfig(filename=log_path, format='%(asctime)s:%(levelname)s: %(message)s', level=logging.INFO)
-    datafile = "data/warfarin.csv"
-    patients = load_data(datafile)
+    datafile = args.data
     models = []
     logging.info(f"Initializing recommender model(s): {args.algo}")
 
@@ -88,7 +163,14 @@ if __name__ == '__main__':
     else:   # run a single model
         models += [get_recommender(args.algo, output_path)]
 
-    iters = args.iter if args.iter else 1
-    train_ratio = args.train_ratio if args.train_ratio is not None else 0.8
-
-    evaluation.run(patients, models, iters, train_ratio, verbose=True)
+    # parse only the columns used by the selected models
+    selected = get_required_columns(models)
+    if args.stream:
+        evaluation.run_online(stream_data(datafile, args.batch_size, selected=selected), models, verbose=True)
+    else:
+        patients = load_data(datafile, use_cache=not args.no_cache, workers=args.workers, selected=selected)
+        iters = args.iter if args.iter else 1
+        train_ratio = args.train_ratio if args.train_ratio is not None else 0.8
+
+        evaluation.run(patients, models, iters, train_ratio, verbose=True, replicas=args.replicas,
+                       train_workers=args.train_workers)